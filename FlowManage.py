@@ -1,6 +1,7 @@
 """ Main FlowManage start script """
 import sys
 import flowmanage as fm
+from flowmanage import profiler
 
 def main():
     """
@@ -18,7 +19,16 @@ def main():
         fm.con.print("[red]--airspace            Create the airspace json files.")
         fm.con.print("[red]--scenario            Create the scenario scn files.")
         fm.con.print("[red]--qgis                Run qgis algorthims.")
+        fm.con.print("[red]--heights             Compute the building heights per road edge.")
+        fm.con.print("[red]--validate            Validate the scenario scn files.")
+        fm.con.print("[red]--conflicts           Screen the scenarios for conflict density.")
+        fm.con.print("[red]--occupancy           Count the flights per layer, heading range and time bucket.")
         fm.con.print("[red]--multi num_workers   Multiprocessing option with workers.")
+        fm.con.print("[red]--profile             Profile the stages and hot functions.")
+        fm.con.print("[red]--batch cfg1 cfg2 ... Run the selected modules for each config file in parallel.")
+        fm.con.print("[red]--watch               Rerun the selected modules when the settings or inputs change.")
+        fm.con.print("[red]--ensemble num        Create num independent replicates of odpoints, intentions and scenarios.")
+        fm.con.print("[red]--queue               Create the scenarios with the other --queue processes on the shared filesystem.")
         quit()  
     
     if '--airspace' in sys.argv:
@@ -31,44 +41,78 @@ def main():
         mode = 'odpoints'
     elif '--qgis' in sys.argv:
         mode = 'qgis'
+    elif '--heights' in sys.argv:
+        mode = 'heights'
+    elif '--validate' in sys.argv:
+        mode = 'validate'
+    elif '--conflicts' in sys.argv:
+        mode = 'conflicts'
+    elif '--occupancy' in sys.argv:
+        mode = 'occupancy'
     else:
         mode = 'all'
 
     if '--multi' in sys.argv:
         try:
             multi = int(sys.argv[sys.argv.index('--multi') + 1])
-        except IndexError:
+        except (IndexError, ValueError):
             multi = 4
     
         fm.con.print(f"[magenta]Using {multi} workers.")
     else:
         multi = None
     
-    # Initialize necessary modules
-    fm.init(mode)
+    if '--profile' in sys.argv:
+        profiler.init()
 
-    # run the selected modules
-    if mode == 'intention':
-        fm.inten.process()
+    if '--batch' in sys.argv:
+        # run the selected modules for every config file in its own process
+        from flowmanage import batch
+        cfgfiles = [arg for arg in sys.argv[sys.argv.index('--batch') + 1:] if arg.endswith('.cfg')]
+        batch.run(cfgfiles, mode, multi)
+        return
 
-    elif mode == 'airspace':
-        fm.air.process()
+    if '--ensemble' in sys.argv:
+        # create independent replicates in a process pool
+        from flowmanage import ensemble
+        try:
+            n_replicates = int(sys.argv[sys.argv.index('--ensemble') + 1])
+        except (IndexError, ValueError):
+            n_replicates = 4
 
-    elif mode == 'scenario':
-        fm.scen.process(multi)
+        with profiler.record('init'):
+            fm.settings.init()
 
-    elif mode == 'odpoints':
-        fm.odpoints.process()
+        with profiler.record('ensemble'):
+            ensemble.run(n_replicates, multi)
 
-    elif mode == 'qgis':
-        # Nothing happens here if qgis is selected
-        from flowmanage.pyqgis import start
-        start()
-    
-    else:
-        fm.inten.process()
-        fm.air.process()
-        fm.scen.process(multi)
+        profiler.report()
+        return
+
+    if '--queue' in sys.argv:
+        # claim the intention files with the other workers on the shared filesystem
+        with profiler.record('init'):
+            fm.init('scenario')
+
+        fm.scen.process_queue(multi)
+
+        profiler.report()
+        return
+
+    if '--watch' in sys.argv:
+        # keep the data in memory and rerun the affected modules on every change
+        from flowmanage import watch
+        watch.run(mode, multi)
+        return
+
+    # Initialize necessary modules
+    with profiler.record('init'):
+        fm.init(mode)
+
+    # run the selected modules
+    fm.run(mode, multi)
+
+    profiler.report()
     
 
 if __name__ == "__main__":
@@ -5,12 +5,16 @@ from rich.console import Console
 air = None
 inten = None
 scen = None
+conflicts = None
+heights = None
+validator = None
+occupancy = None
 
 # printing objects
 con = Console()
 
 
-def init(mode='all') -> None:
+def init(mode='all', cfgfile='settings.cfg', overrides=None) -> None:
     """
     Initialize the main objects.
 
@@ -18,8 +22,8 @@ def init(mode='all') -> None:
     """
 
     # Initialize global settings
-    settings.init()
-    global air, inten, scen, odpoints
+    settings.init(cfgfile, overrides)
+    global air, inten, scen, odpoints, conflicts, heights, validator, occupancy
 
     if mode == 'airspace':
         from flowmanage.airspacedesign import AirspaceDesign
@@ -41,6 +45,30 @@ def init(mode='all') -> None:
         from flowmanage.odpoints import StreetCenterPoints
         odpoints = StreetCenterPoints()
 
+    elif mode == 'heights':
+        """This is only used if specified in the command line"""
+
+        from flowmanage.airspacedesign import BuildingHeights
+        heights = BuildingHeights()
+
+    elif mode == 'validate':
+        """This is only used if specified in the command line"""
+
+        from flowmanage.scenariomaker import ScenarioValidator
+        validator = ScenarioValidator()
+
+    elif mode == 'conflicts':
+        """This is only used if specified in the command line"""
+
+        from flowmanage.analysis import ConflictScreen
+        conflicts = ConflictScreen()
+
+    elif mode == 'occupancy':
+        """This is only used if specified in the command line"""
+
+        from flowmanage.analysis import LayerOccupancy
+        occupancy = LayerOccupancy()
+
     elif mode == 'all':
         from flowmanage.airspacedesign import AirspaceDesign 
         from flowmanage.intentionmaker import IntentionMaker
@@ -48,4 +76,50 @@ def init(mode='all') -> None:
 
         air = AirspaceDesign()
         inten = IntentionMaker()
-        scen = ScenarioMaker()
\ No newline at end of file
+        scen = ScenarioMaker()
+
+
+def run(mode='all', multi=None) -> None:
+    """
+    Run the modules selected with mode. init() must be called first.
+    """
+
+    if mode == 'intention':
+        inten.process(multi)
+
+    elif mode == 'airspace':
+        air.process()
+
+    elif mode == 'scenario':
+        scen.process(multi)
+
+    elif mode == 'odpoints':
+        odpoints.process()
+
+    elif mode == 'heights':
+        heights.process()
+
+    elif mode == 'validate':
+        validator.process(multi)
+
+    elif mode == 'conflicts':
+        conflicts.process(multi)
+
+    elif mode == 'occupancy':
+        occupancy.process(multi)
+
+    elif mode == 'qgis':
+        # Nothing happens here if qgis is selected
+        from flowmanage.pyqgis import start
+        start()
+    
+    elif settings.handoff_intentions and settings.demand_intentions:
+        # the intentions go to the scenario maker in memory, the files are only written if asked
+        inten.process(multi, handoff=True)
+        air.process()
+        scen.process_intentions(inten.intention_batches(write=settings.handoff_write_intentions))
+
+    else:
+        inten.process(multi)
+        air.process()
+        scen.process(multi)
\ No newline at end of file
@@ -1 +1,2 @@
-from .airspacedesign import AirspaceDesign
\ No newline at end of file
+from .airspacedesign import AirspaceDesign
+from .buildingheights import BuildingHeights, EdgeHeights
\ No newline at end of file
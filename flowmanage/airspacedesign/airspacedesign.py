@@ -1,9 +1,11 @@
+import os
 import json
 
 import numpy as np
 from copy import deepcopy
 
 import flowmanage as fm
+from flowmanage import profiler
 
 class AirspaceDesign:
     def __init__(self) -> None:
@@ -31,6 +33,7 @@ class AirspaceDesign:
         self.airspace_config = {}
         self.airspace_info = {}
         
+    @profiler.stage
     def process(self) -> None:
 
         # step 1.a: initialize the airspace info
@@ -77,6 +80,7 @@ class AirspaceDesign:
         airspace = {'config': self.airspace_config, 'info': self.airspace_info}
 
         # save layers to json
+        os.makedirs(os.path.dirname(self.airspace_filepath) or '.', exist_ok=True)
         with open(self.airspace_filepath, 'w') as fp:
             json.dump(airspace, fp, indent=4)
             
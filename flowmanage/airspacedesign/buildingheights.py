@@ -0,0 +1,95 @@
+import os
+
+import numpy as np
+import geopandas as gpd
+
+import flowmanage as fm
+from flowmanage import profiler, geodata
+
+
+class BuildingHeights(geodata.PrefetchedData):
+    def __init__(self) -> None:
+
+        # submit all reads at once, each dataset is only waited for when first used
+        # read osmx graph from data and get nodes and edges
+        self.prefetch_graph(fm.settings.graph_path)
+
+        # get the buildings (only the height is needed)
+        self.height_col = fm.settings.building_height_col
+        self.prefetch('buildings', geodata.read_study_layer, fm.settings.buildings, columns=[self.height_col])
+
+        # process the rest of settings
+        self.building_buffer = fm.settings.building_buffer
+        self.building_clearance = fm.settings.building_clearance
+        self.heights_path = fm.settings.building_heights_path
+
+    @profiler.stage
+    def process(self) -> None:
+
+        fm.con.print('[magenta]Computing building heights per edge...')
+
+        max_heights = self.edge_heights()
+
+        # save the edge ids with their heights in the order of self.edges
+        u, v, key = (self.edges.index.get_level_values(level).to_numpy() for level in range(3))
+
+        os.makedirs(os.path.dirname(self.heights_path) or '.', exist_ok=True)
+        np.savez(self.heights_path, u=u, v=v, key=key, max_height=max_heights,
+                 min_safe_altitude=max_heights + np.float32(self.building_clearance))
+
+        fm.con.print(f'[magenta]Saving edge heights to [bold green]{self.heights_path}[/] ...')
+
+    @profiler.hotpath
+    def edge_heights(self) -> np.ndarray:
+        """Get the maximum height of the buildings within self.building_buffer of every edge.
+        All edges are buffered at once and joined to the buildings with one spatial join.
+
+        Returns:
+            np.ndarray: float32 array with the maximum building height of each edge in
+                self.edges. Edges without nearby buildings of known height get 0.
+        """
+        # buildings without a height would make the maximum NaN
+        buildings = self.buildings[[self.height_col, self.buildings.geometry.name]]
+        buildings = buildings[buildings[self.height_col].notna()]
+
+        # buffer the edges in the projected crs of the buildings
+        edges = self.edges.geometry.to_crs(buildings.crs)
+        buffered_edges = gpd.GeoDataFrame(geometry=edges.buffer(self.building_buffer).values, crs=buildings.crs)
+
+        joined = gpd.sjoin(buffered_edges, buildings, predicate='intersects', how='inner')
+
+        max_heights = np.zeros(len(edges), dtype=np.float32)
+        np.maximum.at(max_heights, joined.index.to_numpy(), joined[self.height_col].to_numpy(dtype=np.float32))
+
+        return max_heights
+
+
+class EdgeHeights:
+    """Building heights per edge saved by BuildingHeights. Lookups are O(1)."""
+
+    def __init__(self, heights_path: str | None = None) -> None:
+        """
+        Args:
+            heights_path (str | None, optional): path of the edge heights file.
+                Defaults to fm.settings.building_heights_path.
+        """
+        if heights_path is None:
+            heights_path = fm.settings.building_heights_path
+
+        with np.load(heights_path) as data:
+            self.u = data['u']
+            self.v = data['v']
+            self.key = data['key']
+            self.max_height = data['max_height']
+            self.min_safe_altitude = data['min_safe_altitude']
+
+        # position of each edge in the arrays
+        self.edge_ids = {edge: idx for idx, edge in enumerate(zip(self.u.tolist(), self.v.tolist(), self.key.tolist()))}
+
+    def edge_max_height(self, u: int, v: int, key: int = 0) -> float:
+        """Maximum height of the buildings near edge (u, v, key)."""
+        return float(self.max_height[self.edge_ids[(u, v, key)]])
+
+    def edge_min_altitude(self, u: int, v: int, key: int = 0) -> float:
+        """Minimum safe altitude above edge (u, v, key)."""
+        return float(self.min_safe_altitude[self.edge_ids[(u, v, key)]])
@@ -0,0 +1,2 @@
+from .conflicts import ConflictScreen
+from .occupancy import LayerOccupancy
\ No newline at end of file
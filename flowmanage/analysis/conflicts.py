@@ -0,0 +1,197 @@
+import os
+import json
+from multiprocessing import Pool as ThreadPool
+from rich.progress import track
+from rich.table import Table
+
+import numpy as np
+
+import flowmanage as fm
+from flowmanage import profiler
+from flowmanage.scenariomaker.scnreader import read_scn, scenario_name
+
+# mean earth radius (m) and knots to m/s
+EARTH_RADIUS = 6371000.0
+KTS = 0.514444
+
+
+class ConflictScreen:
+    def __init__(self) -> None:
+
+        # get the scenario files to screen
+        self.scenario_folder = fm.settings.scenarios
+        self.scenario_files = [file for file in os.listdir(self.scenario_folder) if not file.startswith('.')]
+
+        if not self.scenario_files:
+            fm.con.print('[red bold]No scenario files found!')
+            fm.con.print("[red bold]Try:[/] [green]python FlowManage.py --scenario")
+            quit()
+
+        # process the rest of settings
+        self.conflict_folder = fm.settings.conflict_folder
+        self.cell_size = fm.settings.conflict_cell_size
+        self.time_window = fm.settings.conflict_time_window
+        self.max_cell_pairs = fm.settings.conflict_max_cell_pairs
+        self.avg_speed = fm.settings.avg_speed
+
+    @profiler.stage
+    def process(self, multi: int | None = None) -> None:
+        """Screen all scenario files and save a summary.
+        Args:
+            multi (int | None, optional): Number of workers to use. Defaults to None.
+        """
+
+        fm.con.print('[magenta]Screening scenarios for conflicts...')
+
+        os.makedirs(self.conflict_folder, exist_ok=True)
+
+        if multi:
+            pool = ThreadPool(multi)
+            summary = pool.map(self.screen, self.scenario_files)
+            pool.close()
+        else:
+            summary = [self.screen(scenario_file) for scenario_file in
+                       track(self.scenario_files, description="[magenta]Processing...", console=fm.con)]
+
+        self.print_summary(summary)
+
+        # save the summary of all scenarios
+        summary_path = os.path.join(self.conflict_folder, 'summary.json')
+        with open(summary_path, 'w') as fp:
+            json.dump(summary, fp, indent=4)
+
+        fm.con.print(f'[magenta]Saving conflict screening to [bold green]{self.conflict_folder}[/] ...')
+
+    @profiler.hotpath
+    def screen(self, scenario_file: str) -> dict:
+        """Estimate the potential conflicts of one scenario file.
+
+        The straight-line trajectories are sampled at least once per cell and time
+        window and hashed into a space-time grid. Every pair of flights that shares
+        a cell in the same time window is counted as a potential conflict. Counting
+        is done by sorting the cell keys so it is O(n log n) in the number of samples.
+
+        The heatmaps are saved to an npz file with the same name as the scenario.
+
+        Args:
+            scenario_file (str): name of the scenario file.
+
+        Returns:
+            dict: summary statistics of the scenario.
+        """
+        flights = read_scn(os.path.join(self.scenario_folder, scenario_file))
+        n_flights = len(flights)
+
+        summary = {'scenario': scenario_file, 'flights': n_flights, 'potential_conflicts': 0,
+                   'max_cell_pairs': 0, 'peak_window_pairs': 0, 'peak_window_start': 0, 'rejected': False}
+
+        if not n_flights:
+            return summary
+
+        # local equirectangular projection around the mean origin
+        lat0 = flights['origin_lat'].mean()
+        lon0 = flights['origin_lon'].mean()
+
+        flight_ids, x, y, t = self.sample_trajectories(flights, lat0, lon0)
+
+        # space-time cell of each sample
+        x_min, y_min = x.min(), y.min()
+        ix = ((x - x_min) // self.cell_size).astype(np.int64)
+        iy = ((y - y_min) // self.cell_size).astype(np.int64)
+        it = (t // self.time_window).astype(np.int64)
+        nx, ny, nt = ix.max() + 1, iy.max() + 1, it.max() + 1
+
+        cell_keys = (it * ny + iy) * nx + ix
+
+        # each flight is counted once per cell
+        flight_cell_keys = np.unique(cell_keys * n_flights + flight_ids)
+        cell_keys, flights_in_cell = np.unique(flight_cell_keys // n_flights, return_counts=True)
+
+        # potential conflict pairs in each occupied cell
+        cell_pairs = flights_in_cell * (flights_in_cell - 1) // 2
+
+        cell_it, rest = np.divmod(cell_keys, nx * ny)
+
+        # heatmaps of the potential conflicts and the occupancy over the scenario
+        heatmap = np.bincount(rest, cell_pairs, nx * ny).astype(np.int64).reshape(ny, nx)
+        occupancy = np.bincount(rest, flights_in_cell, nx * ny).astype(np.int64).reshape(ny, nx)
+
+        # potential conflicts per time window
+        window_pairs = np.bincount(cell_it, cell_pairs, nt).astype(np.int64)
+        window_max_cell_pairs = np.zeros(nt, dtype=np.int64)
+        np.maximum.at(window_max_cell_pairs, cell_it, cell_pairs)
+
+        np.savez_compressed(os.path.join(self.conflict_folder, f'{scenario_name(scenario_file)}.npz'),
+                            heatmap=heatmap, occupancy=occupancy, window_pairs=window_pairs,
+                            window_max_cell_pairs=window_max_cell_pairs,
+                            origin=np.array([x_min, y_min, lat0, lon0]),
+                            cell_size=self.cell_size, time_window=self.time_window)
+
+        summary['potential_conflicts'] = int(cell_pairs.sum())
+        summary['max_cell_pairs'] = int(cell_pairs.max())
+        summary['peak_window_pairs'] = int(window_pairs.max())
+        summary['peak_window_start'] = int(np.argmax(window_pairs)) * self.time_window
+        summary['rejected'] = summary['max_cell_pairs'] > self.max_cell_pairs
+
+        return summary
+
+    def sample_trajectories(self, flights, lat0: float, lon0: float) -> tuple:
+        """Sample the straight-line trajectories of all flights at once.
+
+        Each flight is sampled at least every time window and every cell size
+        travelled, so no cell or time window it passes through is skipped.
+
+        Args:
+            flights (pd.DataFrame): creation commands from read_scn().
+            lat0 (float): latitude of the origin of the local projection.
+            lon0 (float): longitude of the origin of the local projection.
+
+        Returns:
+            tuple: flight ids, x (m), y (m) and time (s) of all samples.
+        """
+        cos_lat0 = np.cos(np.radians(lat0))
+
+        x_orig = EARTH_RADIUS * np.radians(flights['origin_lon'].to_numpy() - lon0) * cos_lat0
+        y_orig = EARTH_RADIUS * np.radians(flights['origin_lat'].to_numpy() - lat0)
+        dx = EARTH_RADIUS * np.radians(flights['destination_lon'].to_numpy() - lon0) * cos_lat0 - x_orig
+        dy = EARTH_RADIUS * np.radians(flights['destination_lat'].to_numpy() - lat0) - y_orig
+
+        # use the average speed if the speed is missing
+        speed = flights['spd'].to_numpy(dtype=float) * KTS
+        speed = np.where(speed > 0, speed, self.avg_speed * KTS)
+
+        duration = np.hypot(dx, dy) / speed
+        step = np.minimum(self.time_window, self.cell_size / speed)
+
+        # number of samples of each flight including both ends
+        n_samples = np.ceil(duration / step).astype(np.int64) + 1
+        flight_ids = np.repeat(np.arange(len(flights)), n_samples)
+        sample_ids = np.arange(len(flight_ids)) - np.repeat(np.cumsum(n_samples) - n_samples, n_samples)
+
+        # fraction of the trajectory flown at each sample
+        sample_time = np.minimum(sample_ids * step[flight_ids], duration[flight_ids])
+        fraction = np.divide(sample_time, duration[flight_ids], out=np.zeros(len(flight_ids)),
+                             where=duration[flight_ids] > 0)
+
+        x = x_orig[flight_ids] + fraction * dx[flight_ids]
+        y = y_orig[flight_ids] + fraction * dy[flight_ids]
+        t = flights['spawn_time'].to_numpy()[flight_ids] + sample_time
+
+        return flight_ids, x, y, t
+
+    def print_summary(self, summary: list) -> None:
+        """Print the summary of all scenarios as a table."""
+        table = Table(title='Conflict screening')
+        table.add_column('Scenario', style='green')
+        table.add_column('Flights', justify='right')
+        table.add_column('Potential conflicts', justify='right')
+        table.add_column('Max cell pairs', justify='right')
+        table.add_column('Peak window pairs', justify='right')
+        table.add_column('Status')
+
+        for entry in summary:
+            status = '[red]rejected' if entry['rejected'] else '[green]ok'
+            table.add_row(entry['scenario'], str(entry['flights']), str(entry['potential_conflicts']),
+                          str(entry['max_cell_pairs']), str(entry['peak_window_pairs']), status)
+
+        fm.con.print(table)
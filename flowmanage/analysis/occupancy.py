@@ -0,0 +1,256 @@
+import os
+import json
+from multiprocessing import Pool as ThreadPool
+from rich.progress import track
+from rich.table import Table
+
+import numpy as np
+
+import flowmanage as fm
+from flowmanage import profiler
+from flowmanage.analysis.conflicts import EARTH_RADIUS, KTS
+from flowmanage.scenariomaker.scnreader import read_scn, scenario_name
+
+
+class LayerOccupancy:
+    def __init__(self) -> None:
+
+        # get the scenario files to analyse
+        self.scenario_folder = fm.settings.scenarios
+        self.scenario_files = [file for file in os.listdir(self.scenario_folder) if not file.startswith('.')]
+
+        if not self.scenario_files:
+            fm.con.print('[red bold]No scenario files found!')
+            fm.con.print("[red bold]Try:[/] [green]python FlowManage.py --scenario")
+            quit()
+
+        if not os.path.isfile(fm.settings.airspace_filepath):
+            fm.con.print('[red bold]No airspace layers found!')
+            fm.con.print("[red bold]Try:[/] [green]python FlowManage.py --airspace")
+            quit()
+
+        # get the layers and their heading ranges
+        with open(fm.settings.airspace_filepath) as fp:
+            self.levels, self.heading_edges, self.level_headings = self.read_layers(json.load(fp)['info'])
+
+        # process the rest of settings
+        self.occupancy_folder = fm.settings.occupancy_folder
+        self.time_bucket = fm.settings.occupancy_time_bucket
+        self.heading_layers = fm.settings.occupancy_heading_layers
+        self.layer_capacity = fm.settings.occupancy_layer_capacity
+        self.avg_speed = fm.settings.avg_speed
+
+    @profiler.stage
+    def process(self, multi: int | None = None) -> None:
+        """Compute the layer occupancy of all scenario files and save a summary.
+        Args:
+            multi (int | None, optional): Number of workers to use. Defaults to None.
+        """
+
+        fm.con.print('[magenta]Computing the layer occupancy of the scenarios...')
+
+        os.makedirs(self.occupancy_folder, exist_ok=True)
+
+        if multi:
+            pool = ThreadPool(multi)
+            summary = pool.map(self.occupancy, self.scenario_files)
+            pool.close()
+        else:
+            summary = [self.occupancy(scenario_file) for scenario_file in
+                       track(self.scenario_files, description="[magenta]Processing...", console=fm.con)]
+
+        self.print_summary(summary)
+
+        # save the summary of all scenarios
+        summary_path = os.path.join(self.occupancy_folder, 'summary.json')
+        with open(summary_path, 'w') as fp:
+            json.dump(summary, fp, indent=4)
+
+        fm.con.print(f'[magenta]Saving layer occupancy to [bold green]{self.occupancy_folder}[/] ...')
+
+    @staticmethod
+    def read_layers(info: dict) -> tuple:
+        """Get the layers and heading ranges of the airspace info of layers.json.
+
+        Args:
+            info (dict): 'info' entry of layers.json with the 'levels' and, for a
+                heading airspace, the 'headings' of each level as 'min-max'.
+
+        Returns:
+            tuple: heights of the layers, edges of the heading ranges (deg) and
+                heading range of each layer. Without headings there is one range.
+        """
+        levels = np.asarray(info['levels'], dtype=float)
+
+        if 'headings' not in info:
+            return levels, np.array([0.0, 360.0]), np.zeros(len(levels), dtype=np.int64)
+
+        ranges = np.array([heading.split('-') for heading in info['headings']], dtype=float)
+        heading_edges = np.union1d(ranges[:, 0], ranges[:, 1])
+        level_headings = np.searchsorted(heading_edges, ranges[:, 0])
+
+        return levels, heading_edges, level_headings
+
+    @profiler.hotpath
+    def occupancy(self, scenario_file: str) -> dict:
+        """Count the flights in each layer and heading range per time bucket.
+
+        Every flight flies its straight line at its speed in one layer. It is
+        counted in every time bucket from its spawn to its arrival. The counts
+        are built with a difference array: +1 in the spawn bucket and -1 after
+        the arrival bucket of each flight, summed with one bincount and
+        accumulated over time, so the cost is linear in the number of flights.
+
+        The occupancy array of shape (layers, heading ranges, time buckets) and
+        the flight time in each layer and heading range are saved to an npz
+        file with the same name as the scenario.
+
+        Args:
+            scenario_file (str): name of the scenario file.
+
+        Returns:
+            dict: summary statistics of the scenario.
+        """
+        flights = read_scn(os.path.join(self.scenario_folder, scenario_file))
+        n_flights = len(flights)
+
+        summary = {'scenario': scenario_file, 'flights': n_flights, 'peak_occupancy': 0, 'peak_layer': None,
+                   'peak_heading': None, 'peak_time': 0, 'layer_balance': 0.0, 'overloaded_buckets': 0}
+
+        if not n_flights:
+            return summary
+
+        heading, duration = self.flight_lines(flights)
+
+        # heading range and layer of each flight
+        n_layers, n_headings = len(self.levels), len(self.heading_edges) - 1
+        heading_ids = np.clip(np.searchsorted(self.heading_edges, heading, side='right') - 1, 0, n_headings - 1)
+        layer_ids = self.assign_layers(flights, heading_ids)
+
+        # first and last time bucket of each flight
+        spawn_time = flights['spawn_time'].to_numpy()
+        start = (spawn_time // self.time_bucket).astype(np.int64)
+        end = ((spawn_time + duration) // self.time_bucket).astype(np.int64)
+        n_buckets = int(end.max()) + 1
+
+        # difference array over (layer, heading range, bucket) with one spare bucket for the -1 of the last flights
+        cell_ids = (layer_ids * n_headings + heading_ids) * (n_buckets + 1)
+        n_cells = n_layers * n_headings * (n_buckets + 1)
+        diff = np.bincount(cell_ids + start, minlength=n_cells) - np.bincount(cell_ids + end + 1, minlength=n_cells)
+
+        occupancy = np.cumsum(diff.reshape(n_layers, n_headings, n_buckets + 1), axis=2)[:, :, :-1]
+        occupancy = occupancy.astype(np.min_scalar_type(occupancy.max()))
+
+        # airborne seconds in each layer and heading range
+        flight_time = np.bincount(layer_ids * n_headings + heading_ids, duration,
+                                  n_layers * n_headings).reshape(n_layers, n_headings)
+
+        np.savez_compressed(os.path.join(self.occupancy_folder, f'{scenario_name(scenario_file)}.npz'),
+                            occupancy=occupancy, flight_time=flight_time, levels=self.levels,
+                            heading_edges=self.heading_edges, time_bucket=self.time_bucket)
+
+        peak_layer, peak_heading, peak_bucket = np.unravel_index(np.argmax(occupancy), occupancy.shape)
+        layer_time = flight_time.sum(axis=1)
+
+        summary['peak_occupancy'] = int(occupancy.max())
+        summary['peak_layer'] = float(self.levels[peak_layer])
+        summary['peak_heading'] = f'{self.heading_edges[peak_heading]:g}-{self.heading_edges[peak_heading + 1]:g}'
+        summary['peak_time'] = int(peak_bucket) * self.time_bucket
+
+        # 1 if the flight time is spread evenly over the layers
+        summary['layer_balance'] = float(layer_time.mean() / layer_time.max()) if layer_time.max() > 0 else 0.0
+
+        if self.layer_capacity is not None:
+            summary['overloaded_buckets'] = int(np.count_nonzero(occupancy > self.layer_capacity))
+
+        return summary
+
+    def flight_lines(self, flights) -> tuple:
+        """Heading and duration of the straight lines of all flights.
+
+        Args:
+            flights (pd.DataFrame): creation commands from read_scn().
+
+        Returns:
+            tuple: heading (deg from north) and duration (s) of each flight.
+        """
+        lat0 = flights['origin_lat'].mean()
+        cos_lat0 = np.cos(np.radians(lat0))
+
+        dx = EARTH_RADIUS * np.radians(flights['destination_lon'].to_numpy() - flights['origin_lon'].to_numpy()) * cos_lat0
+        dy = EARTH_RADIUS * np.radians(flights['destination_lat'].to_numpy() - flights['origin_lat'].to_numpy())
+
+        heading = np.degrees(np.arctan2(dx, dy)) % 360
+
+        # use the average speed if the speed is missing
+        speed = flights['spd'].to_numpy(dtype=float) * KTS
+        speed = np.where(speed > 0, speed, self.avg_speed * KTS)
+
+        return heading, np.hypot(dx, dy) / speed
+
+    def assign_layers(self, flights, heading_ids: np.ndarray) -> np.ndarray:
+        """Layer of each flight.
+
+        With fm.settings.occupancy_heading_layers the flights of a heading range
+        are spread evenly over the layers of that range, like the heading
+        airspace would do. Otherwise the layer closest to the altitude of the
+        scenario is used.
+
+        Args:
+            flights (pd.DataFrame): creation commands from read_scn().
+            heading_ids (np.ndarray): heading range of each flight.
+
+        Returns:
+            np.ndarray: position of the layer of each flight in self.levels.
+        """
+        if not self.heading_layers:
+            # the layer below or above, whichever is closer
+            midpoints = (self.levels[1:] + self.levels[:-1]) / 2
+            return np.searchsorted(midpoints, flights['alt'].to_numpy(dtype=float))
+
+        # layers of each heading range, a range without layers uses all layers
+        n_headings = len(self.heading_edges) - 1
+        counts = np.bincount(self.level_headings, minlength=n_headings)
+        range_layers = [np.flatnonzero(self.level_headings == idx) if counts[idx] else np.arange(len(self.levels))
+                        for idx in range(n_headings)]
+        counts = np.array([len(layers) for layers in range_layers])
+
+        # table of the layers of each range, padded to the same length
+        table = np.zeros((n_headings, counts.max()), dtype=np.int64)
+        for idx, layers in enumerate(range_layers):
+            table[idx, :len(layers)] = layers
+
+        # the n-th flight of a heading range goes to the layer n modulo the number of layers
+        order = np.argsort(heading_ids, kind='stable')
+        sorted_ids = heading_ids[order]
+        rank = np.empty(len(heading_ids), dtype=np.int64)
+        rank[order] = np.arange(len(heading_ids)) - np.searchsorted(sorted_ids, sorted_ids)
+
+        return table[heading_ids, rank % counts[heading_ids]]
+
+    def print_summary(self, summary: list) -> None:
+        """Print the summary of all scenarios as a table."""
+        table = Table(title='Layer occupancy')
+        table.add_column('Scenario', style='green')
+        table.add_column('Flights', justify='right')
+        table.add_column('Peak occupancy', justify='right')
+        table.add_column('Peak layer', justify='right')
+        table.add_column('Peak heading', justify='right')
+        table.add_column('Peak time [s]', justify='right')
+        table.add_column('Layer balance', justify='right')
+
+        if self.layer_capacity is not None:
+            table.add_column('Overloaded buckets', justify='right')
+
+        for entry in summary:
+            row = [entry['scenario'], str(entry['flights']), str(entry['peak_occupancy']),
+                   f"{entry['peak_layer']:g}" if entry['peak_layer'] is not None else '-',
+                   entry['peak_heading'] or '-', str(entry['peak_time']), f"{entry['layer_balance']:.2f}"]
+
+            if self.layer_capacity is not None:
+                status = 'red' if entry['overloaded_buckets'] else 'green'
+                row.append(f"[{status}]{entry['overloaded_buckets']}")
+
+            table.add_row(*row)
+
+        fm.con.print(table)
@@ -0,0 +1,139 @@
+'''FlowManage batch module'''
+import os
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from rich.console import Console
+from rich.progress import Progress
+from rich.table import Table
+
+import flowmanage as fm
+
+# settings with output paths that are moved to the output root of each pipeline
+output_settings = ['airspace', 'scenarios', 'airspace_filepath', 'conflict_folder', 'profile_path',
+                   'building_heights_path', 'center_points', 'validation_path',
+                   'occupancy_folder']
+
+
+def run(cfgfiles: list, mode: str = 'all', multi: int | None = None, workers: int | None = None) -> list:
+    '''
+    Run the selected modules for every config file. Each pipeline runs in its own
+    process with its own settings and writes to its own output root
+    (batch_output/<config name> of its config file).
+
+    Parameters
+    ----------
+    cfgfiles : list
+        Paths of the config files.
+    mode : str, optional
+        Modules to run, see fm.run(), by default 'all'.
+    multi : int | None, optional
+        Number of workers inside each pipeline, by default None.
+    workers : int | None, optional
+        Number of pipelines to run at the same time. Defaults to the number
+        of config files, at most the number of cpus.
+
+    Returns
+    -------
+    list
+        One result dictionary per config file.
+    '''
+    if not cfgfiles:
+        fm.con.print('[red bold]No config files given!')
+        fm.con.print("[red bold]Try:[/] [green]python FlowManage.py --batch vienna.cfg other.cfg")
+        return []
+
+    if workers is None:
+        workers = min(len(cfgfiles), os.cpu_count() or 1)
+
+    fm.con.print(f'[magenta]Running {len(cfgfiles)} pipelines with {workers} workers...')
+
+    results = []
+
+    # spawn gives every pipeline a fresh interpreter so nothing is shared between settings
+    context = multiprocessing.get_context('spawn')
+    with Progress(console=fm.con) as progress, ProcessPoolExecutor(workers, mp_context=context) as executor:
+        task = progress.add_task('[magenta]Pipelines...', total=len(cfgfiles))
+
+        futures = {executor.submit(run_pipeline, cfgfile, name, mode, multi): cfgfile
+                   for cfgfile, name in zip(cfgfiles, pipeline_names(cfgfiles))}
+
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+                progress.console.print(f"[magenta]Finished [bold green]{result['config']}[/] "
+                                       f"in {result['time']:.1f} s")
+            except Exception as exc:
+                result = {'config': futures[future], 'output': '-', 'time': None, 'status': f'failed: {exc}'}
+                progress.console.print(f"[red]Failed [bold]{futures[future]}[/]: {exc}")
+
+            results.append(result)
+            progress.advance(task)
+
+    print_summary(results)
+
+    return results
+
+
+def pipeline_names(cfgfiles: list) -> list:
+    '''Name of each pipeline, the config file name made unique.'''
+    stems = [os.path.splitext(os.path.basename(cfgfile))[0] for cfgfile in cfgfiles]
+
+    return [stem if stems.count(stem) == 1 else f'{stem}_{idx}' for idx, stem in enumerate(stems)]
+
+
+def run_pipeline(cfgfile: str, name: str, mode: str = 'all', multi: int | None = None) -> dict:
+    '''
+    Run the modules of one config file. This runs in a worker process.
+
+    The output paths of the config file are moved to batch_output/name. The
+    intention folder is only moved if the pipeline creates the intention files,
+    otherwise it is read as input. The console output is written to a log file
+    in the output root.
+    '''
+    start = time.perf_counter()
+
+    # read the settings first to find the output root
+    fm.con = Console(quiet=True)
+    fm.settings.init(cfgfile)
+
+    output_root = os.path.join(fm.settings.batch_output, name)
+
+    overrides = {key: os.path.join(output_root, getattr(fm.settings, key)) for key in output_settings
+                 if hasattr(fm.settings, key)}
+
+    # generated intentions go to the output of the configuration, read ones stay in the input folder
+    if fm.settings.demand_intentions and mode in ('intention', 'all'):
+        overrides['intentions'] = os.path.join(output_root, fm.settings.intentions)
+
+    os.makedirs(output_root, exist_ok=True)
+    log_path = os.path.join(output_root, 'flowmanage.log')
+
+    with open(log_path, 'w') as log:
+        fm.con = Console(file=log, width=120)
+
+        try:
+            fm.init(mode, cfgfile, overrides)
+            fm.run(mode, multi)
+        except SystemExit:
+            # stages quit when their input is missing
+            raise RuntimeError(f'pipeline stopped, see {log_path}')
+
+    return {'config': cfgfile, 'output': output_root, 'time': time.perf_counter() - start, 'status': 'done'}
+
+
+def print_summary(results: list) -> None:
+    '''Print the result of every pipeline as a table.'''
+    table = Table(title='FlowManage batch')
+    table.add_column('Config', style='green')
+    table.add_column('Output root')
+    table.add_column('Time [s]', justify='right')
+    table.add_column('Status')
+
+    for result in results:
+        run_time = '-' if result['time'] is None else f"{result['time']:.1f}"
+        status = '[green]done' if result['status'] == 'done' else f"[red]{result['status']}"
+        table.add_row(result['config'], result['output'], run_time, status)
+
+    fm.con.print(table)
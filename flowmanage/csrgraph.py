@@ -0,0 +1,263 @@
+'''FlowManage compact road graph module'''
+import os
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse import csgraph
+from scipy.spatial import cKDTree
+
+import flowmanage as fm
+from flowmanage import profiler, geodata, sharedmem
+
+# mean earth radius (m)
+EARTH_RADIUS = 6371000.0
+
+
+class CSRGraph:
+    '''
+    Road graph in compressed sparse row form.
+
+    The outgoing edges of node i are indptr[i]:indptr[i+1]. All attributes are flat
+    numpy arrays so the graph can be saved as one .npz, shared between processes and
+    passed to scipy.sparse.csgraph.
+
+    Attributes
+    ----------
+    node_ids : np.ndarray
+        int64 osmid of each node.
+    xy : np.ndarray
+        float32 (lon, lat) of each node with shape (n, 2).
+    indptr : np.ndarray
+        int64 offsets of the outgoing edges of each node.
+    indices : np.ndarray
+        int32 position of the target node of each edge.
+    keys : np.ndarray
+        int32 key of each edge in the osmnx graph.
+    length : np.ndarray
+        float32 length of each edge (m).
+    geometry_offsets : np.ndarray
+        int64 offsets of the coordinates of each edge in geometry_xy.
+    geometry_xy : np.ndarray
+        float32 (lon, lat) of the edge geometries with shape (k, 2).
+    '''
+
+    arrays = ['node_ids', 'xy', 'indptr', 'indices', 'keys', 'length', 'geometry_offsets', 'geometry_xy']
+
+    def __init__(self, node_ids, xy, indptr, indices, keys, length, geometry_offsets, geometry_xy) -> None:
+        self.node_ids = node_ids
+        self.xy = xy
+        self.indptr = indptr
+        self.indices = indices
+        self.keys = keys
+        self.length = length
+        self.geometry_offsets = geometry_offsets
+        self.geometry_xy = geometry_xy
+
+        # built when first needed
+        self._kdtree = None
+        self._matrix = None
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.node_ids)
+
+    @property
+    def n_edges(self) -> int:
+        return len(self.indices)
+
+    @property
+    def nbytes(self) -> int:
+        '''Memory used by the arrays of the graph.'''
+        return sum(getattr(self, name).nbytes for name in self.arrays)
+
+    @classmethod
+    def from_networkx(cls, G) -> 'CSRGraph':
+        '''
+        Convert an osmnx graph.
+
+        Parameters
+        ----------
+        G : nx.MultiDiGraph
+            Graph with 'x' and 'y' node attributes and 'length' and optionally
+            'geometry' edge attributes.
+
+        Returns
+        -------
+        CSRGraph
+            The converted graph.
+        '''
+        node_ids = np.fromiter(G.nodes, dtype=np.int64, count=G.number_of_nodes())
+        position = {node: idx for idx, node in enumerate(G.nodes)}
+        xy = np.array([(data['x'], data['y']) for _, data in G.nodes(data=True)], dtype=np.float32)
+
+        edges = list(G.edges(keys=True, data=True))
+        u = np.array([position[edge[0]] for edge in edges], dtype=np.int64)
+
+        # order the edges by their source node
+        order = np.argsort(u, kind='stable')
+        edges = [edges[idx] for idx in order]
+
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(u, minlength=len(node_ids)))]).astype(np.int64)
+        indices = np.array([position[edge[1]] for edge in edges], dtype=np.int32)
+        keys = np.array([edge[2] for edge in edges], dtype=np.int32)
+        length = np.array([edge[3].get('length', 0.0) for edge in edges], dtype=np.float32)
+
+        # straight edges do not have a geometry and go from node to node
+        geometries = []
+        for source, target, _, data in edges:
+            if 'geometry' in data:
+                geometries.append(np.asarray(data['geometry'].coords, dtype=np.float32)[:, :2])
+            else:
+                geometries.append(xy[[position[source], position[target]]])
+
+        geometry_offsets = np.concatenate([[0], np.cumsum([len(coords) for coords in geometries])]).astype(np.int64)
+        geometry_xy = np.concatenate(geometries) if geometries else np.zeros((0, 2), dtype=np.float32)
+
+        return cls(node_ids, xy, indptr, indices, keys, length, geometry_offsets, geometry_xy)
+
+    def save(self, file_path: str) -> None:
+        '''Save the graph as an .npz file.'''
+        # write to a temporary file first so parallel runs never read half a file
+        tmp_path = f'{file_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **{name: getattr(self, name) for name in self.arrays})
+        os.replace(tmp_path, file_path)
+
+    @classmethod
+    def load(cls, file_path: str) -> 'CSRGraph':
+        '''Load a graph saved with save().'''
+        with np.load(file_path) as data:
+            return cls(**{name: data[name] for name in cls.arrays})
+
+    def sources(self) -> np.ndarray:
+        '''Position of the source node of each edge.'''
+        return np.repeat(np.arange(self.n_nodes, dtype=np.int32), np.diff(self.indptr))
+
+    def edge_geometry(self, edge: int) -> np.ndarray:
+        '''(lon, lat) coordinates of an edge.'''
+        return self.geometry_xy[self.geometry_offsets[edge]:self.geometry_offsets[edge + 1]]
+
+    def to_scipy(self) -> csr_matrix:
+        '''
+        Sparse adjacency matrix with the edge lengths for scipy.sparse.csgraph.
+        Of parallel edges only the shortest is kept.
+        '''
+        if self._matrix is None:
+            sources = self.sources()
+
+            # sort by source, target and length and keep the first of each pair
+            order = np.lexsort((self.length, self.indices, sources))
+            pairs = sources[order].astype(np.int64) * self.n_nodes + self.indices[order]
+            first = np.concatenate([[True], pairs[1:] != pairs[:-1]])
+            order = order[first]
+
+            self._matrix = csr_matrix((self.length[order].astype(np.float64), (sources[order], self.indices[order])),
+                                      shape=(self.n_nodes, self.n_nodes))
+
+        return self._matrix
+
+    def shortest_path_lengths(self, sources: np.ndarray, limit: float = np.inf) -> np.ndarray:
+        '''
+        Network distances from each source with Dijkstra.
+
+        Parameters
+        ----------
+        sources : np.ndarray
+            Node positions to start from.
+        limit : float, optional
+            Stop searching at this distance (m), by default np.inf.
+
+        Returns
+        -------
+        np.ndarray
+            Array of shape (len(sources), n_nodes), np.inf where the node is
+            not reachable within the limit.
+        '''
+        return csgraph.dijkstra(self.to_scipy(), indices=sources, limit=limit)
+
+    def nearest_nodes(self, lon: np.ndarray, lat: np.ndarray, return_distance: bool = False):
+        '''
+        Position of the nearest node of each point.
+
+        Distances are measured in an equirectangular projection around the
+        graph, which is accurate at city scale.
+
+        Parameters
+        ----------
+        lon : np.ndarray
+            Longitude of the points.
+        lat : np.ndarray
+            Latitude of the points.
+        return_distance : bool, optional
+            Also return the distance to the nearest node (m), by default False.
+
+        Returns
+        -------
+        np.ndarray | tuple
+            Node positions, and their distances if return_distance is set.
+        '''
+        cos_lat0 = np.cos(np.radians(np.mean(self.xy[:, 1])))
+
+        if self._kdtree is None:
+            self._kdtree = cKDTree(np.column_stack([self.xy[:, 0] * cos_lat0, self.xy[:, 1]]))
+
+        distance, nearest = self._kdtree.query(np.column_stack([np.asarray(lon) * cos_lat0, np.asarray(lat)]))
+
+        if return_distance:
+            return nearest, EARTH_RADIUS * np.radians(distance)
+
+        return nearest
+
+
+def csr_path(graph_path: str) -> str:
+    '''Path of the .npz next to the graph file.'''
+    return os.path.splitext(graph_path)[0] + '.npz'
+
+
+@profiler.hotpath
+def load(graph_path: str, rebuild: bool = False) -> CSRGraph:
+    '''
+    Load the compact version of a graph. It is converted and saved next to
+    the graph file if it does not exist or is older than the graph file.
+
+    Parameters
+    ----------
+    graph_path : str
+        Path of the graphml file.
+    rebuild : bool, optional
+        Always convert the graph again, by default False.
+
+    Returns
+    -------
+    CSRGraph
+        The compact graph.
+    '''
+    file_path = csr_path(graph_path)
+
+    if (not rebuild and os.path.isfile(file_path)
+            and os.path.getmtime(file_path) >= os.path.getmtime(graph_path)):
+        return CSRGraph.load(file_path)
+
+    fm.con.print(f'[magenta]Converting the graph to [bold green]{file_path}[/] ...')
+
+    # share the graph read of a stage that prefetched it with the same arguments as prefetch_graph(),
+    # but inside the io pool read it here: the prefetched read can be queued behind this one
+    future = None if geodata.in_io_pool() else geodata.submitted(geodata.load_graph, graph_path, False)
+    G = future.result() if future is not None else geodata.load_graph(graph_path, False)
+
+    graph = CSRGraph.from_networkx(G)
+    graph.save(file_path)
+
+    return graph
+
+
+def shared_matrix() -> csr_matrix:
+    '''
+    The matrix of CSRGraph.to_scipy() built on the arrays published with
+    sharedmem.publish_graph(), without copying them.
+    '''
+    indptr = sharedmem.get('csgraph_indptr')
+    n_nodes = len(indptr) - 1
+
+    return csr_matrix((sharedmem.get('csgraph_weights'), sharedmem.get('csgraph_indices'), indptr),
+                      shape=(n_nodes, n_nodes), copy=False)
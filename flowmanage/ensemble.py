@@ -0,0 +1,219 @@
+'''FlowManage ensemble module'''
+import os
+import json
+import time
+import inspect
+from multiprocessing import Pool as ThreadPool
+
+import numpy as np
+import shapely
+from rich.table import Table
+
+import flowmanage as fm
+from flowmanage import profiler, sharedmem
+from flowmanage.odpoints import StreetCenterPoints
+from flowmanage.intentionmaker import IntentionMaker
+from flowmanage.intentionmaker.demand import DemandSampler
+from flowmanage.intentionmaker.intentionindex import build_index
+from flowmanage.intentionmaker.intentionmaker import chunked_far_pairs
+from flowmanage.scenariomaker.scenariomaker import write_scenario
+
+# center points of the ensemble in a pool worker
+_center_points = None
+
+
+def run(n_replicates: int, multi: int | None = None) -> list:
+    '''
+    Create independent replicates of a study. The center points and the
+    origin-destination candidates are computed once; every replicate then draws
+    its own origin/destination split, intentions and scenarios in a process pool.
+
+    The random stream of each replicate is spawned from one SeedSequence, so the
+    replicates are statistically independent and the whole ensemble can be
+    reproduced from the entropy saved in ensemble_output/ensemble.json.
+
+    Parameters
+    ----------
+    n_replicates : int
+        Number of replicates.
+    multi : int | None, optional
+        Number of workers, by default the number of replicates, at most the number of cpus.
+
+    Returns
+    -------
+    list
+        One result dictionary per replicate.
+    '''
+    if not fm.settings.demand_intentions:
+        fm.con.print('[red bold]No intentions to create!')
+        fm.con.print('[red bold]Set[/] [green]demand_intentions[/] [red bold]in the settings.')
+        return []
+
+    # the replicates pair the center points by their straight-line distance only
+    if fm.settings.geofence_filter == 'drop' or fm.settings.network_feasibility:
+        fm.con.print('[red bold]The ensemble does not drop geofenced or infeasible pairs!')
+        fm.con.print("[red bold]Set[/] [green]geofence_filter[/] [red bold]to None or 'flag' and[/] "
+                     "[green]network_feasibility = False[/] [red bold]in the settings.")
+        return []
+
+    if multi is None:
+        multi = min(n_replicates, os.cpu_count() or 1)
+
+    seed_sequence = np.random.SeedSequence(fm.settings.ensemble_seed)
+    seeds = seed_sequence.spawn(n_replicates)
+
+    fm.con.print(f'[magenta]Creating {n_replicates} replicates with {multi} workers '
+                 f'(entropy {seed_sequence.entropy})...')
+
+    center_points = candidate_points()
+    specs = publish_candidates(center_points, multi)
+
+    try:
+        args = list(enumerate(seeds))
+
+        if multi > 1:
+            pool = ThreadPool(multi, initializer=init_worker, initargs=(specs, center_points, settings_values()))
+            results = pool.map(run_replicate, args)
+            pool.close()
+        else:
+            init_worker(specs, center_points, {})
+            results = [run_replicate(arg) for arg in args]
+    finally:
+        sharedmem.release()
+
+    # the entropy and the spawn keys are enough to recreate every replicate
+    os.makedirs(fm.settings.ensemble_output, exist_ok=True)
+    with open(os.path.join(fm.settings.ensemble_output, 'ensemble.json'), 'w') as fp:
+        json.dump({'entropy': seed_sequence.entropy, 'replicates': results}, fp, indent=4)
+
+    print_summary(results)
+
+    return results
+
+
+def candidate_points():
+    '''Get the center points once for all replicates.'''
+    fm.con.print('[magenta]Creating street center points...')
+
+    odpoints = StreetCenterPoints()
+    center_points = odpoints.get_center_points(fm.settings.edge_cutoff)
+
+    return odpoints.filter_center_points(center_points, odpoints.grid)
+
+
+@profiler.hotpath
+def publish_candidates(center_points, multi: int | None = None) -> dict:
+    '''
+    Publish the coordinates of the center points and all pairs that are further
+    than fm.settings.min_distance apart, as indptr/indices arrays, to shared memory.
+    The pairs are computed in chunks, with multi workers if given.
+    '''
+    xy = shapely.get_coordinates(center_points.geometry.values)
+    lonlat = shapely.get_coordinates(center_points.geometry.to_crs(epsg=4326).values)
+
+    origin_ids, destination_ids = chunked_far_pairs(xy, xy, fm.settings.min_distance, multi)
+
+    specs = sharedmem.publish('candidate_xy', xy)
+    specs.update(sharedmem.publish('candidate_lonlat', lonlat))
+    specs.update(sharedmem.publish('candidate_indptr', np.concatenate(
+        [[0], np.cumsum(np.bincount(origin_ids, minlength=len(xy)))]).astype(np.int64)))
+    specs.update(sharedmem.publish('candidate_indices', destination_ids.astype(np.int32)))
+
+    return specs
+
+
+def settings_values() -> dict:
+    '''Plain values of the settings to send to workers that do not share the memory of this process.'''
+    return {key: value for key, value in vars(fm.settings).items()
+            if not key.startswith('_') and not inspect.ismodule(value) and not inspect.isfunction(value)}
+
+
+def init_worker(specs: dict, center_points, settings: dict) -> None:
+    '''Pool initializer with the candidates of the ensemble.'''
+    global _center_points
+
+    sharedmem.init_worker(specs)
+    _center_points = center_points
+
+    # spawned workers start without settings
+    for key, value in settings.items():
+        if not hasattr(fm.settings, key):
+            setattr(fm.settings, key, value)
+
+
+def run_replicate(args: tuple) -> dict:
+    '''
+    Create the odpoints split, intentions and scenarios of one replicate in
+    ensemble_output/replicate_<n>.
+    '''
+    replicate, seed = args
+    start = time.perf_counter()
+    rng = np.random.default_rng(seed)
+
+    xy = sharedmem.get('candidate_xy')
+    lonlat = sharedmem.get('candidate_lonlat')
+    indptr = sharedmem.get('candidate_indptr')
+    indices = sharedmem.get('candidate_indices')
+
+    output_root = os.path.join(fm.settings.ensemble_output, f'replicate_{replicate}')
+    intention_folder = os.path.join(output_root, 'intentions')
+    scenario_folder = os.path.join(output_root, 'scenarios')
+    os.makedirs(intention_folder, exist_ok=True)
+    os.makedirs(scenario_folder, exist_ok=True)
+
+    # split the center points into origins and destinations
+    is_origin = StreetCenterPoints.split_origins(len(xy), rng)
+
+    center_points = _center_points.copy()
+    center_points['origin'] = is_origin
+    center_points.to_file(os.path.join(output_root, 'center_points.gpkg'), driver='GPKG')
+
+    origins = np.flatnonzero(is_origin)
+    destinations = np.flatnonzero(~is_origin)
+
+    # valid destinations of each origin as positions in destinations
+    destination_position = np.cumsum(~is_origin) - 1
+    valid_destinations = []
+    for origin in origins:
+        candidates = indices[indptr[origin]:indptr[origin + 1]]
+        valid_destinations.append(destination_position[candidates[~is_origin[candidates]]])
+
+    sampler = DemandSampler.gravity(xy[origins], np.full(len(origins), float(fm.settings.sending_weight)),
+                                    xy[destinations], np.ones(len(destinations)), valid_destinations,
+                                    fm.settings.gravity_beta)
+
+    n_total = 0
+    for name, n_flights in fm.settings.demand_intentions.items():
+        origin_ids, destination_ids = sampler.sample(n_flights, rng)
+        intentions = IntentionMaker.intention_table(lonlat[origins[origin_ids]], lonlat[destinations[destination_ids]],
+                                                    rng, fm.settings.intention_cols)
+
+        file_name = f'Flight_intention_{name}_{n_flights}_{replicate}.csv'
+        intention_path = os.path.join(intention_folder, file_name)
+        intentions.to_csv(intention_path, index=False, header=False)
+        build_index(intention_path, names=fm.settings.intention_cols)
+
+        write_scenario(intentions, os.path.join(scenario_folder, file_name.replace('csv', 'scn')),
+                       fm.settings.scen_cols, fm.settings.default_values, fm.settings.scenario_header,
+                       fm.settings.scenario_compression, fm.settings.scenario_compression_level)
+
+        n_total += n_flights
+
+    return {'replicate': replicate, 'spawn_key': list(seed.spawn_key), 'output': output_root,
+            'origins': len(origins), 'flights': n_total, 'time': time.perf_counter() - start}
+
+
+def print_summary(results: list) -> None:
+    '''Print the replicates as a table.'''
+    table = Table(title='FlowManage ensemble')
+    table.add_column('Replicate', justify='right')
+    table.add_column('Output', style='green')
+    table.add_column('Origins', justify='right')
+    table.add_column('Flights', justify='right')
+    table.add_column('Time [s]', justify='right')
+
+    for result in results:
+        table.add_row(str(result['replicate']), result['output'], str(result['origins']), str(result['flights']),
+                      f"{result['time']:.1f}")
+
+    fm.con.print(table)
@@ -0,0 +1,269 @@
+'''FlowManage geodata loading module'''
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import osmnx as ox
+import geopandas as gpd
+from shapely.geometry import box
+
+try:
+    import pyogrio
+except ImportError:
+    pyogrio = None
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+import flowmanage as fm
+from flowmanage import profiler
+
+# io thread pool and the reads that were submitted to it
+_executor = None
+_futures = {}
+_lock = threading.Lock()
+
+# name prefix of the io pool threads
+THREAD_PREFIX = 'geodata'
+
+
+class PrefetchedData:
+    '''
+    Base class for stages that read their datasets in the background.
+
+    Datasets are submitted with prefetch() in the constructor and become normal
+    attributes. Accessing one of them blocks only until that dataset is read.
+    '''
+
+    def prefetch(self, name: str, func, *args, **kwargs) -> None:
+        '''Submit a read and make its result available as attribute name.'''
+        self.__dict__.setdefault('_prefetched', {})[name] = submit(func, *args, **kwargs)
+
+        # remember the files that were read so changes can be traced back to the stage
+        self.__dict__.setdefault('_sources', set()).update(arg for arg in args if isinstance(arg, str))
+
+    def prefetch_graph(self, graph_path: str, add_lengths: bool = False) -> None:
+        '''Read the graph as self.G and its nodes and edges as self.nodes and self.edges.'''
+        # the graph is submitted first so the nodes and edges never wait on a queued read
+        self.prefetch('G', load_graph, graph_path, add_lengths)
+        self.prefetch('nodes', graph_gdf, graph_path, add_lengths, 'nodes')
+        self.prefetch('edges', graph_gdf, graph_path, add_lengths, 'edges')
+
+    def prefetch_csr_graph(self, graph_path: str) -> None:
+        '''Read the compact version of the graph as self.csr_graph.'''
+        from flowmanage import csrgraph
+        self.prefetch('csr_graph', csrgraph.load, graph_path)
+
+    def __getattr__(self, name):
+        # only called when the attribute is not set yet
+        prefetched = self.__dict__.get('_prefetched', {})
+
+        if name not in prefetched:
+            raise AttributeError(f'{type(self).__name__!r} object has no attribute {name!r}')
+
+        value = prefetched[name].result()
+        setattr(self, name, value)
+
+        return value
+
+    def __getstate__(self):
+        # futures can not be pickled so wait for all reads before
+        # the object is sent to a pool worker
+        state = self.__dict__.copy()
+        for name, future in state.pop('_prefetched', {}).items():
+            state.setdefault(name, future.result())
+
+        return state
+
+
+def submit(func, *args, **kwargs):
+    '''
+    Submit a read to the io thread pool.
+
+    Identical reads share one future so stages that need the same dataset only
+    read it once. The returned datasets are shared and should not be modified in place.
+
+    Returns
+    -------
+    concurrent.futures.Future
+        Future with the result of func(*args, **kwargs).
+    '''
+    global _executor
+
+    key = read_key(func, *args, **kwargs)
+
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=fm.settings.io_workers, thread_name_prefix=THREAD_PREFIX)
+
+        if key not in _futures:
+            _futures[key] = _executor.submit(func, *args, **kwargs)
+
+        return _futures[key]
+
+
+def submitted(func, *args, **kwargs):
+    '''
+    The future of an identical read that was already submitted, None if there is none.
+
+    Unlike submit() this never queues a read. A read that runs in the io pool must
+    not wait for the result, the read can be queued behind it (see in_io_pool()).
+    '''
+    with _lock:
+        return _futures.get(read_key(func, *args, **kwargs))
+
+
+def in_io_pool() -> bool:
+    '''True if the calling thread is one of the io pool.'''
+    return threading.current_thread().name.startswith(THREAD_PREFIX)
+
+
+def read_key(func, *args, **kwargs) -> str:
+    '''Key of a read, the same function with the same arguments has the same key.'''
+    return repr((func.__module__, func.__qualname__, args, sorted(kwargs.items())))
+
+
+def clear(paths: list | None = None) -> None:
+    '''
+    Forget submitted reads so the next submit reads from disk again.
+
+    Parameters
+    ----------
+    paths : list | None, optional
+        Only forget the reads of these files, by default all reads are forgotten.
+    '''
+    with _lock:
+        if paths is None:
+            _futures.clear()
+            return
+
+        for key in [key for key in _futures if any(repr(path) in key for path in paths)]:
+            del _futures[key]
+
+
+@profiler.hotpath
+def load_graph(graph_path: str, add_lengths: bool = False):
+    '''Read the osmnx graph and optionally (re)compute its edge lengths.'''
+    G = ox.load_graphml(graph_path)
+
+    if add_lengths:
+        ox.distance.add_edge_lengths(G)
+
+    return G
+
+
+@profiler.hotpath
+def graph_gdf(graph_path: str, add_lengths: bool, which: str) -> gpd.GeoDataFrame:
+    '''Get the nodes or edges of the graph once it has been read.'''
+    G = submit(load_graph, graph_path, add_lengths).result()
+
+    return ox.graph_to_gdfs(G, nodes=which == 'nodes', edges=which == 'edges')
+
+
+def read_layer(path: str, columns: list | None = None, bbox: tuple | None = None,
+               bbox_crs=None, layer: str | None = None) -> gpd.GeoDataFrame:
+    '''
+    Read a vector layer with only the columns and features that are needed.
+
+    The column selection and bounding box filter are pushed into the reader so
+    the rest of the layer is never parsed. When pyogrio is available the layer is
+    read through arrow. Both readers return the rows with a 0-based RangeIndex in
+    file order, so the labels (and the ids derived from them) do not depend on the
+    installed reader.
+
+    Parameters
+    ----------
+    path : str
+        Path to the vector file.
+    columns : list | None, optional
+        Attribute columns to read. An empty list only reads the geometry and
+        None reads all columns, by default None.
+    bbox : tuple | None, optional
+        Bounding box (minx, miny, maxx, maxy) to filter the features, by default None.
+    bbox_crs : optional
+        CRS of the bounding box. If given and different from the CRS of the layer
+        the bounding box is reprojected first, by default None.
+    layer : str | None, optional
+        Layer name inside the file, by default None.
+
+    Returns
+    -------
+    gpd.GeoDataFrame
+        The pruned layer.
+    '''
+    if bbox is not None and bbox_crs is not None:
+        bbox = reproject_bbox(path, bbox, bbox_crs, layer)
+
+    if pyogrio is None:
+        # fall back to the default engine and prune the columns afterwards
+        gdf = gpd.read_file(path, bbox=bbox, layer=layer)
+
+        if columns is not None:
+            gdf = gdf[list(columns) + [gdf.geometry.name]]
+
+        return gdf.reset_index(drop=True)
+
+    gdf = gpd.read_file(path, engine='pyogrio', use_arrow=pyarrow is not None, columns=columns,
+                        bbox=bbox, layer=layer)
+
+    return gdf.reset_index(drop=True)
+
+
+def reproject_bbox(path: str, bbox: tuple, bbox_crs, layer: str | None = None) -> tuple:
+    '''Reproject a bounding box to the CRS of a layer.'''
+    if pyogrio is not None:
+        layer_crs = pyogrio.read_info(path, layer=layer)['crs']
+    else:
+        layer_crs = gpd.read_file(path, rows=1, layer=layer).crs
+
+    if layer_crs is None:
+        return bbox
+
+    bbox_series = gpd.GeoSeries([box(*bbox)], crs=bbox_crs)
+
+    if bbox_series.crs == layer_crs:
+        return bbox
+
+    return tuple(bbox_series.to_crs(layer_crs).total_bounds)
+
+
+def study_bbox(buffer: float | None = None) -> tuple:
+    '''
+    Get the bounding box of the constrained airspace.
+
+    Parameters
+    ----------
+    buffer : float | None, optional
+        Distance to expand the bounding box with in the CRS units of the
+        constrained airspace. Defaults to fm.settings.bbox_buffer.
+
+    Returns
+    -------
+    tuple
+        The bounding box (minx, miny, maxx, maxy) and its CRS.
+    '''
+    if buffer is None:
+        buffer = fm.settings.bbox_buffer
+
+    const_path = os.path.join(fm.settings.geo_data, 'airspace', 'constrained_airspace.gpkg')
+    constrained_airspace = read_layer(const_path, columns=[])
+
+    minx, miny, maxx, maxy = constrained_airspace.total_bounds
+    bbox = (minx - buffer, miny - buffer, maxx + buffer, maxy + buffer)
+
+    return bbox, constrained_airspace.crs
+
+
+def read_study_layer(path: str, columns: list | None = None, layer: str | None = None) -> gpd.GeoDataFrame:
+    '''
+    Read a layer pruned to the columns needed by a stage and, if
+    fm.settings.prune_bbox is set, to the bounding box of the constrained airspace.
+    '''
+    if not fm.settings.prune_bbox:
+        return read_layer(path, columns=columns, layer=layer)
+
+    bbox, bbox_crs = study_bbox()
+
+    return read_layer(path, columns=columns, bbox=bbox, bbox_crs=bbox_crs, layer=layer)
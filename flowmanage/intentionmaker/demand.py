@@ -0,0 +1,181 @@
+import numpy as np
+
+
+def build_alias_table(weights: np.ndarray) -> tuple:
+    '''
+    Build an alias table with Vose's method.
+
+    Parameters
+    ----------
+    weights : np.ndarray
+        Non-negative weights of the outcomes, at least one must be positive.
+
+    Returns
+    -------
+    tuple
+        prob (np.ndarray) with the probability to keep outcome i and
+        alias (np.ndarray) with the outcome to take otherwise.
+    '''
+    n = len(weights)
+    scaled = np.asarray(weights, dtype=np.float64) * n / np.sum(weights)
+
+    prob = np.ones(n)
+    alias = np.arange(n)
+
+    small = list(np.flatnonzero(scaled < 1.0))
+    large = list(np.flatnonzero(scaled >= 1.0))
+
+    while small and large:
+        less = small.pop()
+        more = large.pop()
+
+        prob[less] = scaled[less]
+        alias[less] = more
+
+        # the large outcome gives away what the small one is missing
+        scaled[more] = scaled[more] + scaled[less] - 1.0
+        if scaled[more] < 1.0:
+            small.append(more)
+        else:
+            large.append(more)
+
+    # anything left over is 1 up to rounding errors and keeps prob = 1
+    return prob, alias
+
+
+class DemandSampler:
+    '''
+    Draw origin-destination pairs in O(1) each.
+
+    Every origin has its own weighted distribution over its valid destinations.
+    These are kept as alias tables that are concatenated into flat arrays, table i
+    being indptr[i]:indptr[i+1]. The origins themselves are drawn with one more
+    alias table, so a batch of pairs is drawn with a few vectorized numpy operations.
+
+    The table of an origin is only built when the origin is drawn for the first
+    time, so origins that are never drawn cost nothing.
+    '''
+
+    def __init__(self, origin_weights: np.ndarray, indptr: np.ndarray, indices: np.ndarray,
+                 weights: np.ndarray) -> None:
+        '''
+        Parameters
+        ----------
+        origin_weights : np.ndarray
+            Weight of each origin.
+        indptr : np.ndarray
+            Offsets of the destination sets of each origin in indices and weights.
+        indices : np.ndarray
+            Destination ids of all origins.
+        weights : np.ndarray
+            Weight of each origin-destination pair in indices.
+        '''
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices)
+        self.counts = np.diff(self.indptr)
+
+        if not self.counts.any():
+            raise ValueError('No origin has a valid destination.')
+
+        # origins without valid destinations can never be drawn
+        origin_weights = np.where(self.counts > 0, origin_weights, 0.0)
+        self.origin_prob, self.origin_alias = build_alias_table(origin_weights)
+
+        # one alias table per origin, alias entries are local to their table
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.prob = np.ones(len(self.indices))
+        self.alias = np.zeros(len(self.indices), dtype=np.int64)
+        self.built = np.zeros(len(self.counts), dtype=bool)
+
+    @classmethod
+    def gravity(cls, origin_xy: np.ndarray, origin_weights: np.ndarray, destination_xy: np.ndarray,
+                destination_weights: np.ndarray, valid_destinations: list, beta: float = 1.0):
+        '''
+        Create a sampler with a gravity model. The weight of a pair is the product of
+        the origin and destination weights divided by their distance to the power beta.
+
+        Parameters
+        ----------
+        origin_xy : np.ndarray
+            Projected coordinates of the origins with shape (n, 2).
+        origin_weights : np.ndarray
+            Attribute weight of each origin.
+        destination_xy : np.ndarray
+            Projected coordinates of the destinations with shape (m, 2).
+        destination_weights : np.ndarray
+            Attribute weight of each destination.
+        valid_destinations : list
+            For each origin an array with the positions of its valid destinations.
+        beta : float, optional
+            Distance decay exponent, by default 1.0.
+
+        Returns
+        -------
+        DemandSampler
+            The sampler, destinations are drawn as positions in destination_xy.
+        '''
+        counts = np.array([len(dests) for dests in valid_destinations], dtype=np.int64)
+        indptr = np.concatenate([[0], np.cumsum(counts)])
+        indices = np.concatenate(valid_destinations).astype(np.int64) if len(valid_destinations) else np.array([], dtype=np.int64)
+
+        # distances of all valid pairs at once
+        origin_ids = np.repeat(np.arange(len(counts)), counts)
+        distances = np.hypot(*(destination_xy[indices] - origin_xy[origin_ids]).T)
+
+        weights = destination_weights[indices] / np.maximum(distances, 1.0) ** beta
+
+        # the origin weight is split over its destinations in proportion to the pair weights
+        origin_weights = np.asarray(origin_weights, dtype=np.float64) * np.bincount(origin_ids, weights, len(counts))
+
+        return cls(origin_weights, indptr, indices, weights)
+
+    def sample(self, n: int, rng: np.random.Generator | None = None) -> tuple:
+        '''
+        Draw n origin-destination pairs.
+
+        Parameters
+        ----------
+        n : int
+            Number of pairs.
+        rng : np.random.Generator | None, optional
+            Random generator, by default a new unseeded generator.
+
+        Returns
+        -------
+        tuple
+            Origin positions and destination ids, both arrays of length n.
+        '''
+        if rng is None:
+            rng = np.random.default_rng()
+
+        # draw the origins
+        origins = self.draw(self.origin_prob, self.origin_alias, np.zeros(n, dtype=np.int64),
+                            np.full(n, len(self.origin_prob)), rng)
+
+        # draw a destination from the table of each origin
+        self.build_tables(origins)
+        local = self.draw(self.prob, self.alias, self.indptr[origins], self.counts[origins], rng)
+        destinations = self.indices[self.indptr[origins] + local]
+
+        return origins, destinations
+
+    def build_tables(self, origins: np.ndarray) -> None:
+        '''Build the alias tables of the origins that do not have one yet.'''
+        origins = np.unique(origins)
+
+        for i in origins[~self.built[origins]]:
+            start, end = self.indptr[i], self.indptr[i + 1]
+            self.prob[start:end], self.alias[start:end] = build_alias_table(self.weights[start:end])
+
+        self.built[origins] = True
+
+    @staticmethod
+    def draw(prob: np.ndarray, alias: np.ndarray, offsets: np.ndarray, counts: np.ndarray,
+             rng: np.random.Generator) -> np.ndarray:
+        '''Draw one local outcome from each of the alias tables offsets:offsets+counts.'''
+        column = np.minimum((rng.random(len(counts)) * counts).astype(np.int64), counts - 1)
+        slot = offsets + column
+
+        keep = rng.random(len(counts)) < prob[slot]
+
+        return np.where(keep, column, alias[slot])
@@ -0,0 +1,134 @@
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+import flowmanage as fm
+
+
+def index_path(file_path: str) -> str:
+    """Path of the hidden index file next to an intention file."""
+    folder, file_name = os.path.split(file_path)
+
+    return os.path.join(folder, f'.{file_name}.idx.npz')
+
+
+def spawn_seconds(spawn_time: pd.Series) -> np.ndarray:
+    """Convert HH:MM:SS spawn times to seconds."""
+    return pd.to_timedelta(spawn_time).dt.total_seconds().to_numpy()
+
+
+def build_index(file_path: str, bucket_size: int | None = None, names: list | None = None) -> dict | None:
+    """Index the byte offsets of the spawn time buckets of an intention file and
+    save them next to it.
+
+    offsets[b] is the byte offset of the first row that spawns at or after
+    b * bucket_size, the last offset is the end of the file.
+
+    Args:
+        file_path (str): path of the intention file.
+        bucket_size (int | None, optional): size of the buckets (s). Defaults to
+            fm.settings.intention_index_bucket.
+        names (list | None, optional): columns of the file. Defaults to fm.settings.intention_cols.
+
+    Returns:
+        dict | None: the index, or None if the rows are not sorted by spawn time
+            and can not be indexed.
+    """
+    if bucket_size is None:
+        bucket_size = fm.settings.intention_index_bucket
+
+    if names is None:
+        names = fm.settings.intention_cols
+
+    times = spawn_seconds(pd.read_csv(file_path, names=names, usecols=['spawn_time'])['spawn_time'])
+
+    # start of every row and the end of the file
+    data = np.fromfile(file_path, dtype=np.uint8)
+    row_starts = np.flatnonzero(data == ord('\n')) + 1
+    if len(data) and data[-1] != ord('\n'):
+        row_starts = np.append(row_starts, len(data))
+    row_starts = np.concatenate([[0], row_starts])
+
+    # the rows must be sorted and one per line
+    if len(times) != len(row_starts) - 1 or np.any(np.diff(times) < 0):
+        return None
+
+    n_buckets = int(times[-1] // bucket_size) + 1 if len(times) else 0
+    offsets = row_starts[np.searchsorted(times, np.arange(n_buckets + 1) * bucket_size, side='left')]
+
+    stat = os.stat(file_path)
+    index = {'bucket_size': bucket_size, 'offsets': offsets.astype(np.int64),
+             'file_size': stat.st_size, 'file_mtime': stat.st_mtime_ns}
+
+    np.savez(index_path(file_path), **index)
+
+    return index
+
+
+def load_index(file_path: str) -> dict | None:
+    """Load the index of an intention file. Returns None if there is no index
+    or the intention file changed after it was indexed."""
+    path = index_path(file_path)
+
+    if not os.path.isfile(path):
+        return None
+
+    with np.load(path) as data:
+        index = {key: data[key] for key in data.files}
+
+    stat = os.stat(file_path)
+    if index['file_size'] != stat.st_size or index['file_mtime'] != stat.st_mtime_ns:
+        return None
+
+    return index
+
+
+def read_window(file_path: str, start: float, end: float, names: list | None = None) -> pd.DataFrame:
+    """Read the intentions that spawn in [start, end) seconds. Only the bytes of the
+    spawn time buckets that overlap the window are read and parsed. The index is
+    built first if it is missing or out of date.
+
+    Args:
+        file_path (str): path of the intention file.
+        start (float): start of the window (s).
+        end (float): end of the window (s).
+        names (list | None, optional): columns of the file. Defaults to fm.settings.intention_cols.
+
+    Returns:
+        pd.DataFrame: intentions in the window.
+    """
+    if names is None:
+        names = fm.settings.intention_cols
+
+    index = load_index(file_path) or build_index(file_path, names=names)
+
+    if index is None:
+        # unsorted files are read completely
+        intentions = pd.read_csv(file_path, names=names)
+    else:
+        offsets = index['offsets']
+        bucket_size = int(index['bucket_size'])
+        n_buckets = len(offsets) - 1
+
+        first = int(np.clip(np.floor(start / bucket_size), 0, n_buckets))
+        last = int(np.clip(np.ceil(end / bucket_size), first, n_buckets))
+
+        with open(file_path, 'rb') as f:
+            # parse the first row for the dtypes of an empty window
+            first_row = f.readline()
+
+            f.seek(offsets[first])
+            data = f.read(offsets[last] - offsets[first])
+
+        if not data:
+            # a window past the end of the file has the same columns and dtypes as a normal read
+            return pd.read_csv(io.BytesIO(first_row), names=names, dtype=None if first_row else str).iloc[:0]
+
+        intentions = pd.read_csv(io.BytesIO(data), names=names)
+
+    # the first and last bucket can have rows outside of the window
+    times = spawn_seconds(intentions['spawn_time'])
+
+    return intentions[(times >= start) & (times < end)].reset_index(drop=True)
@@ -1,69 +1,542 @@
 import os
+import hashlib
 from multiprocessing import Pool as ThreadPool
-from rich.progress import track
 
-import osmnx as ox
 import numpy as np
 import pandas as pd
+import shapely
 import geopandas as gpd
+from scipy.sparse import csgraph
 
 import flowmanage as fm
+from flowmanage import profiler, geodata, sindex, sharedmem, csrgraph
+from flowmanage.intentionmaker.demand import DemandSampler
+from flowmanage.intentionmaker.intentionindex import build_index
 
-class IntentionMaker:
-    def __init__(self) -> None:
+# knots to m/s
+KTS = 0.514444
 
-        # read osmx graph from data
-        self.G = ox.load_graphml(fm.settings.graph_path)
+class IntentionMaker(geodata.PrefetchedData):
+    def __init__(self) -> None:
 
-        # get nodes and edges
-        self.nodes, self.edges = ox.graph_to_gdfs(self.G)
-        
-        # get receving and sending nodes
-        self.receiving_nodes = gpd.read_file(fm.settings.receiving_nodes)
-        self.sending_nodes = gpd.read_file(fm.settings.sending_nodes)
+        # submit all reads at once, each dataset is only waited for when first used
+        # get receving and sending nodes (only the geometry is needed)
+        self.prefetch('receiving_nodes', geodata.read_study_layer, fm.settings.receiving_nodes, columns=[])
+        self.prefetch('sending_nodes', geodata.read_study_layer, fm.settings.sending_nodes, columns=[])
 
         # get constrained airspace
         const_path = os.path.join(fm.settings.geo_data, 'airspace', 'constrained_airspace.gpkg')
-        self.constrained_airspace = gpd.read_file(const_path)
+        self.prefetch('constrained_airspace', geodata.read_layer, const_path, columns=[])
+
+        # get the geofences (only the geometry is needed)
+        if fm.settings.geofence_filter:
+            geofence_path = os.path.join(fm.settings.geo_data, 'geofences', 'geofences.gpkg')
+            self.prefetch('geofences', geodata.read_study_layer, geofence_path, columns=[])
+
+        # get the compact road graph for the network distances
+        if fm.settings.network_feasibility:
+            self.prefetch_csr_graph(fm.settings.graph_path)
+
+        # get the weighted demand origins (only the weight column is needed)
+        if fm.settings.demand_intentions:
+            for file_name, weight_col in fm.settings.demand_origins.items():
+                layer_path = os.path.join(fm.settings.geo_data, 'traffic', file_name)
+                self.prefetch(self.demand_layer_name(file_name), geodata.read_study_layer, layer_path, columns=[weight_col])
 
         # get more settings
         self.min_distance = fm.settings.min_distance
+        self.geofence_filter = fm.settings.geofence_filter
+        self.network_feasibility = fm.settings.network_feasibility
+        self.intention_cols = fm.settings.intention_cols
+        self.intention_folder = fm.settings.intentions
+        self.multi = None
 
-    def process(self) -> None:
+    @profiler.stage
+    def process(self, multi: int | None = None, handoff: bool = False) -> None:
+        """Find the valid destinations and create the intention files.
+        Args:
+            multi (int | None, optional): Number of workers to use. Defaults to None.
+            handoff (bool, optional): Do not create the intention files, the scenario
+                maker takes them from intention_batches(). Defaults to False.
+        """
+        self.multi = multi
 
         # preparation for intention maker
 
-        # buffer the airspace (10 meters) to get the nodes within the constrained airspace
-        self.buffer_nodes(10)
+        try:
+            # buffer the airspace (10 meters) to get the nodes within the constrained airspace
+            self.buffer_nodes(10)
 
-        # get valid destinations
-        self.get_valid_destinations()
+            # get valid destinations
+            self.get_valid_destinations()
 
+            # create the flight intention files with the weighted demand sampler
+            if fm.settings.demand_intentions and not handoff:
+                self.create_intentions()
+        finally:
+            # free the arrays shared with the workers
+            sharedmem.release()
+
+    @profiler.hotpath
     def buffer_nodes(self, buff_dist=10) -> None:
+
+        self.sending_nodes = self.within_airspace(self.sending_nodes, buff_dist)
+        self.receiving_nodes = self.within_airspace(self.receiving_nodes, buff_dist)
+
+    def within_airspace(self, nodes: gpd.GeoDataFrame, buff_dist=10) -> gpd.GeoDataFrame:
         
         # buffer the airspace (400 meters) to get the nodes within the airspace
         constrained_airspace = self.constrained_airspace.buffer(buff_dist)
 
-        send_bool = self.sending_nodes['geometry'].apply(lambda x: x.within(constrained_airspace.values[0]))
-        receive_bool = self.receiving_nodes['geometry'].apply(lambda x: x.within(constrained_airspace.values[0]))
-
-        self.sending_nodes = self.sending_nodes[send_bool]
-        self.receiving_nodes = self.receiving_nodes[receive_bool]
+        return nodes[nodes.within(constrained_airspace.values[0])]
     
+    @profiler.hotpath
     def get_valid_destinations(self) -> None:
-        # TODO: vectorize this
-        # get list of valid sending receiving pairs
-        # get the distance between each origin and destination point
-        valid_destinations = []
-        for _, row in self.sending_nodes.iterrows():
 
-            # find potential destination points when distance is greater than minimum
-            potential_destinations = self.receiving_nodes.loc[
-                (self.receiving_nodes["geometry"].distance(row["geometry"]) > self.min_distance)
-            ].index.tolist()
-
-            # append to a list of valid destinations for a particular origin
-            valid_destinations.append(potential_destinations)
+        valid_destinations, geofence_destinations, travel_times = self.valid_destinations(self.sending_nodes)
 
         # add the list of valid destinations to the origin gdf
-        self.sending_nodes["valid_destinations"] = valid_destinations
\ No newline at end of file
+        self.sending_nodes["valid_destinations"] = valid_destinations
+
+        # add the estimated flight time over the road network to each valid destination
+        if self.network_feasibility:
+            self.sending_nodes["travel_times"] = travel_times
+
+        # add the destinations whose direct path crosses a geofence
+        if self.geofence_filter == 'flag':
+            self.sending_nodes["geofence_destinations"] = geofence_destinations
+
+    def valid_destinations(self, origins: gpd.GeoDataFrame) -> tuple:
+        """Get the valid destinations of each origin. A destination is valid if it is
+        further than self.min_distance from the origin. If self.geofence_filter is 'drop'
+        destinations whose direct path crosses a geofence are also not valid. If
+        self.network_feasibility is set the destination must also be reachable over the
+        road network within fm.settings.max_flight_time.
+
+        Args:
+            origins (gpd.GeoDataFrame): origin points in the crs of the receiving nodes.
+
+        Returns:
+            tuple: for each origin a list with the labels of its valid receiving nodes,
+                a list with the labels of the receiving nodes whose path crosses a geofence
+                and a list with the network travel times (s) to its valid receiving nodes
+                (NaN without self.network_feasibility).
+        """
+        origin_xy = shapely.get_coordinates(origins.geometry.values)
+        destination_xy = shapely.get_coordinates(self.receiving_nodes.geometry.values)
+
+        # get all sending receiving pairs that are far enough apart
+        origin_ids, destination_ids = self.candidate_pairs(origin_xy, destination_xy)
+
+        # keep the pairs that are connected over the road network
+        travel_time = np.full(len(origin_ids), np.nan)
+        if self.network_feasibility:
+            feasible, travel_time = self.network_travel_times(origins, origin_ids, destination_ids)
+            origin_ids, destination_ids, travel_time = origin_ids[feasible], destination_ids[feasible], travel_time[feasible]
+
+        crossing = np.zeros(len(origin_ids), dtype=bool)
+        if self.geofence_filter:
+            crossing = self.geofence_crossings(origin_xy[origin_ids], destination_xy[destination_ids])
+
+        keep = ~crossing if self.geofence_filter == 'drop' else np.ones(len(origin_ids), dtype=bool)
+
+        # split the pairs into a list of receiving node labels per origin
+        labels = self.receiving_nodes.index.to_numpy()
+        valid_destinations = self.split_pairs(origin_ids[keep], labels[destination_ids[keep]], len(origin_xy))
+        geofence_destinations = self.split_pairs(origin_ids[crossing], labels[destination_ids[crossing]], len(origin_xy))
+        travel_times = self.split_pairs(origin_ids[keep], travel_time[keep], len(origin_xy))
+
+        return valid_destinations, geofence_destinations, travel_times
+
+    def candidate_pairs(self, origin_xy: np.ndarray, destination_xy: np.ndarray, chunk_size: int = 10_000_000) -> tuple:
+        """Get the origin destination pairs that are further than self.min_distance apart,
+        see chunked_far_pairs().
+
+        Returns:
+            tuple: origin positions and destination positions of the pairs, sorted by origin.
+        """
+        return chunked_far_pairs(origin_xy, destination_xy, self.min_distance, self.multi, chunk_size)
+
+    def network_travel_times(self, origins: gpd.GeoDataFrame, origin_ids: np.ndarray, destination_ids: np.ndarray) -> tuple:
+        """Look up the candidate pairs in the feasible pairs of network_pairs().
+
+        Returns:
+            tuple: boolean array that is True if pair i is feasible and the travel time (s)
+                of each pair (NaN if not feasible).
+        """
+        pair_origins, pair_destinations, pair_times = self.network_pairs(origins)
+
+        # the feasible pairs are sorted by origin and destination
+        n_destinations = len(self.receiving_nodes)
+        pair_keys = pair_origins.astype(np.int64) * n_destinations + pair_destinations
+        keys = origin_ids.astype(np.int64) * n_destinations + destination_ids
+
+        if not len(pair_keys):
+            return np.zeros(len(keys), dtype=bool), np.full(len(keys), np.nan)
+
+        positions = np.minimum(np.searchsorted(pair_keys, keys), len(pair_keys) - 1)
+        feasible = pair_keys[positions] == keys
+
+        return feasible, np.where(feasible, pair_times[positions], np.nan)
+
+    @profiler.hotpath
+    def network_pairs(self, origins: gpd.GeoDataFrame) -> tuple:
+        """Get all origin destination pairs that are connected over the road network within
+        fm.settings.max_flight_time at self.avg_speed.
+
+        The origins and receiving nodes are snapped to the nearest node of the compact road
+        graph, the snapping distance is added to the network distance. Bounded Dijkstra
+        searches run from batches of origins, in parallel with self.multi; the workers read the
+        graph from shared memory. No search goes further than the flight time allows, so all
+        pairs shortest paths are never computed. The result is cached next to the graph if
+        fm.settings.feasibility_cache is set.
+
+        Returns:
+            tuple: origin positions, destination positions (sorted by origin and destination) and
+                travel times (s) of the feasible pairs.
+        """
+        graph = self.csr_graph
+
+        origin_lonlat = shapely.get_coordinates(origins.geometry.to_crs(epsg=4326).values)
+        destination_lonlat = shapely.get_coordinates(self.receiving_nodes.geometry.to_crs(epsg=4326).values)
+
+        speed = fm.settings.avg_speed * KTS
+        max_flight_time = fm.settings.max_flight_time or fm.settings.scenario_duration
+        limit = speed * max_flight_time
+
+        # the pairs only depend on the graph, the points and the limit
+        cache_path = None
+        if fm.settings.feasibility_cache:
+            digest = hashlib.blake2b(digest_size=16)
+            for array in (graph.indptr, graph.indices, graph.length, origin_lonlat, destination_lonlat):
+                digest.update(np.ascontiguousarray(array).tobytes())
+            digest.update(repr(limit).encode())
+
+            cache_dir = os.path.join(os.path.dirname(fm.settings.graph_path), '.feasibility')
+            cache_path = os.path.join(cache_dir, f'{digest.hexdigest()}.npz')
+
+            if os.path.isfile(cache_path):
+                with np.load(cache_path) as data:
+                    return data['origins'], data['destinations'], data['travel_time']
+
+        fm.con.print(f'[magenta]Searching the road network for the feasible pairs of {len(origins)} origins...')
+
+        origin_nodes, origin_snap = graph.nearest_nodes(origin_lonlat[:, 0], origin_lonlat[:, 1], return_distance=True)
+        destination_nodes, destination_snap = graph.nearest_nodes(destination_lonlat[:, 0], destination_lonlat[:, 1],
+                                                                  return_distance=True)
+
+        specs = sharedmem.publish_graph(graph)
+        specs.update(sharedmem.publish('origin_nodes', origin_nodes))
+        specs.update(sharedmem.publish('origin_snap', origin_snap))
+        specs.update(sharedmem.publish('destination_nodes', destination_nodes))
+        specs.update(sharedmem.publish('destination_snap', destination_snap))
+
+        batches = [(start, min(start + fm.settings.dijkstra_batch, len(origin_nodes)), limit)
+                   for start in range(0, len(origin_nodes), fm.settings.dijkstra_batch)]
+
+        if self.multi and len(batches) > 1:
+            pool = ThreadPool(self.multi, initializer=sharedmem.init_worker, initargs=(specs,))
+            pairs = pool.map(shared_network_pairs, batches)
+            pool.close()
+        else:
+            pairs = [shared_network_pairs(batch) for batch in batches]
+
+        if not pairs:
+            pairs = [(np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([], dtype=np.float32))]
+
+        pair_origins = np.concatenate([pair[0] for pair in pairs])
+        pair_destinations = np.concatenate([pair[1] for pair in pairs])
+        travel_time = (np.concatenate([pair[2] for pair in pairs]) / speed).astype(np.float32)
+
+        if cache_path:
+            os.makedirs(cache_dir, exist_ok=True)
+
+            # write to a temporary file first so parallel runs never read half a file
+            tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, origins=pair_origins, destinations=pair_destinations, travel_time=travel_time)
+            os.replace(tmp_path, cache_path)
+
+        return pair_origins, pair_destinations, travel_time
+
+    @profiler.hotpath
+    def geofence_crossings(self, origin_xy: np.ndarray, destination_xy: np.ndarray) -> np.ndarray:
+        """Check which direct paths cross a geofence. All paths are built at once and
+        tested with a single STRtree query against the geofences.
+
+        Args:
+            origin_xy (np.ndarray): origin coordinates of the paths with shape (n, 2).
+            destination_xy (np.ndarray): destination coordinates of the paths with shape (n, 2).
+
+        Returns:
+            np.ndarray: boolean array that is True if path i crosses a geofence.
+        """
+        lines = shapely.linestrings(np.stack([origin_xy, destination_xy], axis=1))
+
+        # the paths are new for every demand, so only the tree is reused and the results are not cached
+        geofences = self.geofences.to_crs(self.receiving_nodes.crs).geometry.values
+        line_ids, _ = sindex.SpatialIndex(geofences).query(lines, predicate='intersects')
+
+        crossing = np.zeros(len(lines), dtype=bool)
+        crossing[line_ids] = True
+
+        return crossing
+
+    @staticmethod
+    def split_pairs(origin_ids: np.ndarray, destinations: np.ndarray, n_origins: int) -> list:
+        '''Split pairs that are sorted by origin into a list of destinations per origin.'''
+        counts = np.bincount(origin_ids, minlength=n_origins)
+
+        return [part.tolist() for part in np.split(destinations, np.cumsum(counts)[:-1])]
+
+    @staticmethod
+    def demand_layer_name(file_name: str) -> str:
+        '''Attribute name of a demand origin layer.'''
+        return 'demand_' + os.path.splitext(file_name)[0].lower()
+
+    def get_demand_origins(self) -> gpd.GeoDataFrame:
+        """Get the sending nodes and the demand origin layers within the airspace
+        in one gdf with their demand weight.
+
+        Returns:
+            gpd.GeoDataFrame: origins with a 'weight' and a 'layer' column.
+        """
+        origins = [gpd.GeoDataFrame({'weight': float(fm.settings.sending_weight), 'layer': 'sending'},
+                                    geometry=self.sending_nodes.geometry.values, index=self.sending_nodes.index)]
+
+        for file_name, weight_col in fm.settings.demand_origins.items():
+            layer = getattr(self, self.demand_layer_name(file_name)).to_crs(self.receiving_nodes.crs)
+            layer = self.within_airspace(layer)
+
+            origins.append(gpd.GeoDataFrame({'weight': layer[weight_col].astype(float).values,
+                                             'layer': os.path.splitext(file_name)[0]},
+                                            geometry=shapely.force_2d(layer.geometry.values), index=layer.index,
+                                            crs=layer.crs))
+
+        return gpd.GeoDataFrame(pd.concat(origins), crs=self.receiving_nodes.crs)
+
+    @profiler.hotpath
+    def demand_sampler(self) -> DemandSampler:
+        """Create a gravity model demand sampler over the valid destinations of all
+        demand origins. The origins are kept in self.demand_origins.
+
+        Returns:
+            DemandSampler: sampler that draws positions in self.demand_origins and self.receiving_nodes.
+        """
+        self.demand_origins = self.get_demand_origins()
+
+        # the valid destinations of the sending nodes are already in the sending nodes gdf,
+        # they are only searched for the origins of the other demand layers
+        is_sending = (self.demand_origins['layer'] == 'sending').to_numpy()
+        labels = [None] * len(self.demand_origins)
+
+        for position, destinations in zip(np.flatnonzero(is_sending), self.sending_nodes['valid_destinations']):
+            labels[position] = destinations
+
+        if not is_sending.all():
+            other_destinations = self.valid_destinations(self.demand_origins[~is_sending])[0]
+            for position, destinations in zip(np.flatnonzero(~is_sending), other_destinations):
+                labels[position] = destinations
+
+        # valid destinations as positions in the receiving nodes
+        valid_destinations = [self.receiving_nodes.index.get_indexer(destinations) for destinations in labels]
+
+        origin_xy = shapely.get_coordinates(self.demand_origins.geometry.values)
+        destination_xy = shapely.get_coordinates(self.receiving_nodes.geometry.values)
+
+        return DemandSampler.gravity(origin_xy, self.demand_origins['weight'].values, destination_xy,
+                                     np.ones(len(destination_xy)), valid_destinations, fm.settings.gravity_beta)
+
+    def sample_intentions(self, sampler: DemandSampler, n_flights: int, rng: np.random.Generator) -> pd.DataFrame:
+        """Draw the flight intentions of one intention file.
+
+        Args:
+            sampler (DemandSampler): sampler from demand_sampler().
+            n_flights (int): number of flights.
+            rng (np.random.Generator): random generator.
+
+        Returns:
+            pd.DataFrame: flight intentions with the self.intention_cols columns.
+        """
+        origins, destinations = sampler.sample(n_flights, rng)
+
+        origin_lonlat = shapely.get_coordinates(self.demand_origins.geometry.to_crs(epsg=4326).values)[origins]
+        destination_lonlat = shapely.get_coordinates(self.receiving_nodes.geometry.to_crs(epsg=4326).values)[destinations]
+
+        return self.intention_table(origin_lonlat, destination_lonlat, rng, self.intention_cols)
+
+    @classmethod
+    def intention_table(cls, origin_lonlat: np.ndarray, destination_lonlat: np.ndarray, rng: np.random.Generator,
+                        intention_cols: list) -> pd.DataFrame:
+        """Create the flight intentions of sampled origin destination pairs. The spawn time,
+        aircraft type and priority of each flight are drawn with rng.
+
+        Args:
+            origin_lonlat (np.ndarray): origin (lon, lat) of each flight.
+            destination_lonlat (np.ndarray): destination (lon, lat) of each flight.
+            rng (np.random.Generator): random generator.
+            intention_cols (list): columns of the intention files.
+
+        Returns:
+            pd.DataFrame: flight intentions with the intention_cols columns.
+        """
+        n_flights = len(origin_lonlat)
+
+        # spawn times are spread uniformly over the scenario
+        spawn_time = np.sort(rng.integers(0, fm.settings.scenario_duration, n_flights))
+
+        intentions = pd.DataFrame({
+            'acid': np.char.add('D', np.arange(1, n_flights + 1).astype(str)),
+            'actype': rng.choice(fm.settings.actypes, n_flights),
+            'spawn_time': cls.format_time(spawn_time),
+            'origin_lon': origin_lonlat[:, 0],
+            'origin_lat': origin_lonlat[:, 1],
+            'destination_lon': destination_lonlat[:, 0],
+            'destination_lat': destination_lonlat[:, 1],
+            'priority': rng.choice(fm.settings.priorities, n_flights),
+        })
+
+        return intentions[intention_cols]
+
+    @staticmethod
+    def format_time(seconds: np.ndarray) -> np.ndarray:
+        '''Format seconds as HH:MM:SS strings.'''
+        hours, rest = np.divmod(seconds, 3600)
+        minutes, seconds = np.divmod(rest, 60)
+
+        parts = [np.char.zfill(part.astype(str), 2) for part in (hours, minutes, seconds)]
+
+        return np.char.add(np.char.add(np.char.add(parts[0], ':'), np.char.add(parts[1], ':')), parts[2])
+
+    @profiler.hotpath
+    def create_intentions(self, replicate: int = 0, rng: np.random.Generator | None = None) -> None:
+        """Create the intention files in fm.settings.demand_intentions with the
+        weighted demand sampler.
+
+        Args:
+            replicate (int, optional): replicate number in the file names. Defaults to 0.
+            rng (np.random.Generator | None, optional): random generator. Defaults to
+                a generator seeded with fm.settings.demand_seed.
+        """
+        for _ in self.intention_batches(replicate, rng, write=True):
+            pass
+
+    def intention_batches(self, replicate: int = 0, rng: np.random.Generator | None = None, write: bool = False):
+        """Sample the intentions in fm.settings.demand_intentions one file at a time.
+        A batch is only sampled when the consumer asks for it, so the scenario maker
+        can take the intentions straight from memory.
+
+        Args:
+            replicate (int, optional): replicate number in the file names. Defaults to 0.
+            rng (np.random.Generator | None, optional): random generator. Defaults to
+                a generator seeded with fm.settings.demand_seed.
+            write (bool, optional): also write each batch as an intention file. Defaults to False.
+
+        Yields:
+            tuple: intention file name and the flight intentions of that file.
+        """
+        if rng is None:
+            rng = np.random.default_rng(fm.settings.demand_seed)
+
+        try:
+            sampler = self.demand_sampler()
+        finally:
+            # free the arrays shared with the workers
+            sharedmem.release()
+
+        if write:
+            os.makedirs(self.intention_folder, exist_ok=True)
+
+        for name, n_flights in fm.settings.demand_intentions.items():
+            intentions = self.sample_intentions(sampler, n_flights, rng)
+            file_name = f'Flight_intention_{name}_{n_flights}_{replicate}.csv'
+
+            if write:
+                file_path = os.path.join(self.intention_folder, file_name)
+                intentions.to_csv(file_path, index=False, header=False)
+
+                # index the spawn times so scenarios can read a time window of the file
+                build_index(file_path, names=self.intention_cols)
+
+                fm.con.print(f'[magenta]Saving intentions to [bold green]{file_name}[/] ...')
+
+            yield file_name, intentions
+
+
+def chunked_far_pairs(origin_xy: np.ndarray, destination_xy: np.ndarray, min_distance: float,
+                      multi: int | None = None, chunk_size: int = 10_000_000) -> tuple:
+    '''
+    Pairs of all origins and destinations that are further than min_distance apart.
+
+    The distances are computed in chunks of origins with at most chunk_size pairs.
+    With multi the chunks are spread over the workers, which read the coordinates
+    from shared memory instead of receiving a copy.
+
+    Returns:
+        tuple: origin positions and destination positions of the pairs, sorted by origin.
+    '''
+    chunk = max(1, chunk_size // max(1, len(destination_xy)))
+
+    if multi:
+        chunk = max(1, min(chunk, -(-len(origin_xy) // multi)))
+
+    bounds = [(start, min(start + chunk, len(origin_xy)), min_distance)
+              for start in range(0, len(origin_xy), chunk)]
+
+    if multi and len(bounds) > 1:
+        specs = sharedmem.publish('origin_xy', origin_xy)
+        specs.update(sharedmem.publish('destination_xy', destination_xy))
+
+        pool = ThreadPool(multi, initializer=sharedmem.init_worker, initargs=(specs,))
+        pairs = pool.map(shared_far_pairs, bounds)
+        pool.close()
+
+        sharedmem.release('origin_xy', 'destination_xy')
+    else:
+        pairs = [far_pairs(origin_xy, destination_xy, *bound) for bound in bounds]
+
+    if not pairs:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+
+    return np.concatenate([pair[0] for pair in pairs]), np.concatenate([pair[1] for pair in pairs])
+
+
+def far_pairs(origin_xy: np.ndarray, destination_xy: np.ndarray, start: int, stop: int, min_distance: float) -> tuple:
+    '''Pairs of the origins start:stop and all destinations that are further than min_distance apart.'''
+    diff = origin_xy[start:stop, None, :] - destination_xy[None, :, :]
+    far_origins, far_destinations = np.nonzero(np.hypot(diff[..., 0], diff[..., 1]) > min_distance)
+
+    return far_origins + start, far_destinations
+
+
+def shared_far_pairs(bound: tuple) -> tuple:
+    '''far_pairs() in a pool worker with the coordinates in shared memory.'''
+    return far_pairs(sharedmem.get('origin_xy'), sharedmem.get('destination_xy'), *bound)
+
+
+def shared_network_pairs(batch: tuple) -> tuple:
+    '''
+    Network distances from the origins start:stop to all destinations with a bounded
+    Dijkstra search per origin node. The graph and the snapped points are read from
+    shared memory.
+
+    Returns:
+        tuple: origin positions, destination positions and distances (m) of the pairs
+            within the limit.
+    '''
+    start, stop, limit = batch
+
+    origin_nodes = sharedmem.get('origin_nodes')[start:stop]
+    origin_snap = sharedmem.get('origin_snap')[start:stop]
+    destination_nodes = sharedmem.get('destination_nodes')
+    destination_snap = sharedmem.get('destination_snap')
+
+    # one search per distinct node, origins on the same node share it
+    nodes, rows = np.unique(origin_nodes, return_inverse=True)
+    distances = csgraph.dijkstra(csrgraph.shared_matrix(), indices=nodes, limit=limit)[:, destination_nodes]
+
+    distances = distances[rows] + origin_snap[:, None] + destination_snap[None, :]
+    origin_ids, destination_ids = np.nonzero(distances <= limit)
+
+    return origin_ids + start, destination_ids, distances[origin_ids, destination_ids].astype(np.float32)
+
@@ -1,46 +1,199 @@
 
 import os
-from multiprocessing import Pool as ThreadPool
-from rich.progress import track
 
-import osmnx as ox
 import numpy as np
 import pandas as pd
+import shapely
 import geopandas as gpd
 
 import flowmanage as fm
+from flowmanage import profiler, geodata, sindex
  
-class StreetCenterPoints:
+class StreetCenterPoints(geodata.PrefetchedData):
     def __init__(self) -> None:
 
-        # read osmx graph from data
-        self.G = ox.load_graphml(fm.settings.graph_path)
-        ox.distance.add_edge_lengths(self.G)
+        # submit all reads at once, each dataset is only waited for when first used
+        # read osmx graph from data with edge lengths and get nodes and edges
+        self.prefetch_graph(fm.settings.graph_path, add_lengths=True)
 
-        # get nodes and edges
-        self.nodes, self.edges = ox.graph_to_gdfs(self.G)
+        # get grid by pyqgis module (only the row and column are needed)
+        self.prefetch('grid', geodata.read_study_layer, fm.settings.grid_path, columns=['row', 'col'])
 
-    def process(self) -> None:
+    @profiler.stage
+    def process(self, rng: np.random.Generator | None = None) -> None:
+        '''
+        Create the center points and split them into origins and destinations.
+
+        Parameters
+        ----------
+        rng : np.random.Generator | None, optional
+            Random generator of the split, by default a randomly seeded generator.
+        '''
         
         fm.con.print('[magenta]Creating street center points...')
-        
-        # get all center points as gdf
-        center_points = self.get_center_points(fm.settings.edge_cutoff)
 
-        # get grid by pyqgis module
-        grid = gpd.read_file(fm.settings.grid_path)
-        
-        # filter the points to the grid
-        selected_center_points_gdf = self.filter_center_points(center_points, grid)
+        snapshot = self.edge_snapshot()
+        previous = self.load_edge_snapshot() if fm.settings.incremental_odpoints else None
 
-        # split gdf randomly into origin or destination
-        selected_center_points_gdf['origin'] = np.random.choice([True, False], size=len(selected_center_points_gdf))
+        if previous is not None and self.same_inputs(previous, snapshot):
+            # only redo the grid cells of the edges that changed
+            selected_center_points_gdf = self.update_center_points(previous, snapshot, rng)
+        else:
+            # get all center points as gdf
+            center_points = self.get_center_points(fm.settings.edge_cutoff)
+
+            # filter the points to the grid
+            selected_center_points_gdf = self.filter_center_points(center_points, self.grid)
+
+            # split gdf randomly into origin or destination
+            selected_center_points_gdf['origin'] = self.split_origins(len(selected_center_points_gdf), rng)
 
         # save to a file
         selected_center_points_gdf.to_file(fm.settings.center_points, driver='GPKG')
+        np.savez(self.snapshot_path(), **snapshot)
         fm.con.print('[magenta]Saving filtered center points...')
 
-    def get_center_points(self, edge_cutoff: float) -> gpd.GeoDataFrame:
+    @profiler.hotpath
+    def update_center_points(self, previous: dict, snapshot: dict,
+                             rng: np.random.Generator | None = None) -> gpd.GeoDataFrame:
+        '''
+        Update the saved center points after a change of the road network.
+
+        Only the grid cells that hold the new center point of an added or
+        changed edge, or the selected point of a removed or changed edge, can
+        select another point. Those cells are filtered again with the center
+        points of the edges that cross them, the other cells keep their point
+        and its origin flag. A cell that selects the same edge again also keeps
+        the flag, only new points are split with rng.
+
+        Parameters
+        ----------
+        previous : dict
+            Edge snapshot of the saved center points, see edge_snapshot().
+        snapshot : dict
+            Edge snapshot of the current graph.
+        rng : np.random.Generator | None, optional
+            Random generator of the split of the new points, by default a randomly seeded generator.
+
+        Returns
+        -------
+        gpd.GeoDataFrame
+            Center points with the origin column, in the order of a full run.
+        '''
+        old_points = gpd.read_file(fm.settings.center_points).set_index(['u', 'v', 'key'])
+
+        # compare the edges by id and geometry
+        edge_cols = ['u', 'v', 'key']
+        old_edges = pd.DataFrame({col: previous[col] for col in edge_cols + ['hash']})
+        new_edges = pd.DataFrame({col: snapshot[col] for col in edge_cols + ['hash']})
+        edges = new_edges.merge(old_edges, on=edge_cols, how='outer', suffixes=('', '_old'), indicator=True)
+        modified = (edges['_merge'] == 'both') & (edges['hash'] != edges['hash_old'])
+
+        new_changed = pd.MultiIndex.from_frame(edges.loc[modified | (edges['_merge'] == 'left_only'), edge_cols])
+        old_changed = pd.MultiIndex.from_frame(edges.loc[modified | (edges['_merge'] == 'right_only'), edge_cols])
+
+        # the changed edges that are long enough to have a center point
+        long_edges = self.edges.loc[self.edges['length'] > fm.settings.edge_cutoff]
+        changed_points = self.get_center_points(fm.settings.edge_cutoff, long_edges.loc[long_edges.index.isin(new_changed)])
+        removed_points = old_points.geometry[old_points.index.isin(old_changed)]
+
+        # grid cells that contain one of the changed points
+        cells = np.asarray(self.grid.geometry.values)
+        cell_index = sindex.SpatialIndex(cells)
+        _, touched_cells = cell_index.query(np.concatenate([np.asarray(changed_points.values),
+                                                            np.asarray(removed_points.values)]), predicate='within')
+        touched_cells = np.unique(touched_cells)
+
+        fm.con.print(f'[magenta]Updating {len(touched_cells)} of {len(cells)} grid cells '
+                     f'({len(new_changed)} new and {len(old_changed)} old changed edges)...')
+
+        # old points outside the touched cells stay as they are
+        _, old_in_touched = sindex.SpatialIndex(np.asarray(old_points.geometry.values)).query(
+            cells[touched_cells], predicate='contains')
+        kept_points = old_points.drop(old_points.index[np.unique(old_in_touched)])
+
+        if len(touched_cells):
+            # center points of the edges that cross the touched cells
+            projected_edges = long_edges.to_crs(epsg=32633)
+            _, crossing_edges = sindex.SpatialIndex(np.asarray(projected_edges.geometry.values)).query(
+                cells[touched_cells], predicate='intersects')
+            center_points = self.get_center_points(fm.settings.edge_cutoff, long_edges.iloc[np.unique(crossing_edges)])
+
+            new_points = self.filter_center_points(center_points, self.grid.iloc[touched_cells])
+        else:
+            new_points = gpd.GeoDataFrame(geometry=gpd.GeoSeries(crs='epsg:32633'))
+
+        # points that were selected before keep their flag
+        reselected = new_points.index.isin(old_points.index)
+        new_points['origin'] = self.split_origins(len(new_points), rng)
+        new_points.loc[reselected, 'origin'] = old_points.loc[new_points.index[reselected], 'origin'].to_numpy()
+
+        center_points = pd.concat([kept_points[['geometry', 'origin']], new_points[['geometry', 'origin']]])
+        center_points.index.names = edge_cols
+
+        # order the points like the edges of the graph
+        center_points = center_points.iloc[np.argsort(self.edges.index.get_indexer(center_points.index))]
+
+        return gpd.GeoDataFrame(center_points, geometry='geometry', crs='epsg:32633')
+
+    def edge_snapshot(self) -> dict:
+        '''
+        Ids and geometry hashes of the edges of the graph, and the inputs
+        that select the center points, to find the changed edges in a later run.
+        '''
+        wkb = shapely.to_wkb(np.asarray(self.edges.geometry.values))
+
+        return {'u': self.edges.index.get_level_values(0).to_numpy(dtype=np.int64),
+                'v': self.edges.index.get_level_values(1).to_numpy(dtype=np.int64),
+                'key': self.edges.index.get_level_values(2).to_numpy(dtype=np.int64),
+                'hash': pd.util.hash_array(wkb),
+                'edge_cutoff': np.float64(fm.settings.edge_cutoff),
+                'grid': np.str_(sindex.geometry_hash(self.grid.geometry.values))}
+
+    def snapshot_path(self) -> str:
+        '''Path of the edge snapshot, hidden next to the center points file.'''
+        folder, file_name = os.path.split(fm.settings.center_points)
+
+        return os.path.join(folder, f'.{os.path.splitext(file_name)[0]}.edges.npz')
+
+    def load_edge_snapshot(self) -> dict | None:
+        '''The edge snapshot of the saved center points, None if there are no saved center points.'''
+        if not os.path.isfile(fm.settings.center_points) or not os.path.isfile(self.snapshot_path()):
+            return None
+
+        with np.load(self.snapshot_path()) as data:
+            return {name: data[name] for name in data.files}
+
+    @staticmethod
+    def same_inputs(previous: dict, snapshot: dict) -> bool:
+        '''Check that the grid and the edge cutoff did not change, otherwise all cells have to be redone.'''
+        return (previous['edge_cutoff'] == snapshot['edge_cutoff']
+                and str(previous['grid']) == str(snapshot['grid']))
+
+    @staticmethod
+    def split_origins(n_points: int, rng: np.random.Generator | None = None) -> np.ndarray:
+        '''
+        Randomly mark each center point as origin (True) or destination (False).
+
+        Parameters
+        ----------
+        n_points : int
+            Number of center points.
+        rng : np.random.Generator | None, optional
+            Random generator, by default a randomly seeded generator.
+
+        Returns
+        -------
+        np.ndarray
+            Boolean origin flag of each point.
+        '''
+        if rng is None:
+            rng = np.random.default_rng()
+
+        return rng.choice([True, False], size=n_points)
+
+    @profiler.hotpath
+    def get_center_points(self, edge_cutoff: float, edges: gpd.GeoDataFrame | None = None) -> gpd.GeoDataFrame:
         '''
         Get all center points from the graph. Only edges longer than the edge cutoff are considered.
 
@@ -48,6 +201,8 @@ class StreetCenterPoints:
         ----------
         edge_cutoff : float
             Edge cutoff length.
+        edges : gpd.GeoDataFrame | None, optional
+            Edges to get the center points of, by default all edges of the graph.
         
         Returns
         -------
@@ -56,7 +211,9 @@ class StreetCenterPoints:
         '''
 
         # delete edges smaller than 60 meters
-        edges = self.edges.loc[self.edges['length'] > edge_cutoff]
+        if edges is None:
+            edges = self.edges
+        edges = edges.loc[edges['length'] > edge_cutoff]
 
         # convert to crs 32633
         edges = edges.to_crs(epsg=32633)
@@ -66,6 +223,7 @@ class StreetCenterPoints:
 
         return center_points
 
+    @profiler.hotpath
     def filter_center_points(self, center_points: gpd.GeoDataFrame, grid: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
         '''
         Filter the center points to the grid created with create_grid. 
@@ -125,41 +283,25 @@ class StreetCenterPoints:
         even_cols = list(range(3,n_rows + 1, 4))
         odd_cols = list(range(1,n_rows + 1, 4))
 
-        # filter through the grid cells and get points contained in them
-        selected_points = []
-        for i in track(range(len(grid)), description='[magenta]Filtering center points...'):
-            # get the grid cell
-            cell = grid.geometry.iloc[i]
-
-            # current row
-            row_val = grid.row.iloc[i]
-            col_val = grid.col.iloc[i]
-            
-            # TODO: A bit slow to check (row_val not in odd_cols)
-            # if column is odd and the row is not in odd columns
-            if (col_val % 2) and row_val not in odd_cols:
-                continue
-            
-            # TODO: A bit slow to check (row_val not in even_cols)
-            # if the column is even and the row is not in even columns
-            if (not col_val % 2) and row_val not in even_cols:
-                continue
-            
-            # get the center points within the bounding box
-            center_points_in_cell = center_points.sindex.query(cell, predicate='contains')
-
-            if len(center_points_in_cell) == 0:
-                continue
-
-            # see which point is furthest from the edges of the cell
-            distances = []
-            for center_point_id in center_points_in_cell:
-                center_point = center_points.geometry.iloc[center_point_id]
-                center_point_distance = center_point.distance(cell.boundary)
-                distances.append(center_point_distance)
-
-            # select the point with the largest distance
-            selected_points.append(center_points_in_cell[np.argmax(distances)])
+        # keep the cells of odd columns on odd_cols rows and of even columns on even_cols rows
+        odd_col = (grid.col % 2).astype(bool)
+        keep_cells = np.where(odd_col, grid.row.isin(odd_cols), grid.row.isin(even_cols))
+        cells = np.asarray(grid.geometry.values)[keep_cells]
+
+        # get the center points contained in each cell with one bulk query
+        # the result is cached next to the grid if fm.settings.sindex_cache is set
+        cache_dir = os.path.join(os.path.dirname(fm.settings.grid_path), '.sindex') if fm.settings.sindex_cache else None
+        center_points_index = sindex.SpatialIndex(center_points.geometry.values, cache_dir)
+        cell_ids, center_point_ids = center_points_index.query(cells, predicate='contains')
+
+        # distance from each point to the edges of its cell
+        distances = shapely.distance(center_points_index.geoms[center_point_ids], shapely.boundary(cells[cell_ids]))
+
+        # select the point with the largest distance in each cell
+        # lexsort is stable so ties keep the first point like np.argmax
+        order = np.lexsort((-distances, cell_ids))
+        _, first = np.unique(cell_ids[order], return_index=True)
+        selected_points = center_point_ids[order][first]
         
         # order the points by their value
         selected_points = np.sort(selected_points)
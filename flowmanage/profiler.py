@@ -0,0 +1,284 @@
+'''FlowManage profiling module'''
+import os
+import sys
+import json
+import glob
+import time
+import shutil
+import cProfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from functools import wraps
+
+try:
+    import resource
+except ImportError:
+    # resource is not available on windows
+    resource = None
+
+from rich.table import Table
+
+import flowmanage as fm
+
+# profiling is disabled unless init() is called
+enabled = False
+
+# id of the main process, anything else is a pool worker
+main_pid = None
+
+# id of this run, forked pool workers write their records to workers/<run_id>
+run_id = None
+
+# finished records of the main process
+records = []
+
+# open records for each process and thread, cProfile objects for each process
+_stacks = {}
+_cprofiles = {}
+
+
+def init() -> None:
+    '''Enable profiling for this run.'''
+    global enabled, main_pid, run_id
+
+    enabled = True
+    main_pid = os.getpid()
+    run_id = f'{main_pid}_{time.time_ns()}'
+
+    # records left by a crashed or earlier run must not end up in this report
+    if hasattr(fm.settings, 'profile_path'):
+        shutil.rmtree(os.path.join(fm.settings.profile_path, 'workers'), ignore_errors=True)
+
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+    fm.con.print('[magenta]Profiling enabled.')
+
+
+def stage(func):
+    '''Decorator to profile every call of a pipeline stage.'''
+    return _decorate(func, 'stage')
+
+
+def hotpath(func):
+    '''Decorator to profile every call of a hot function.'''
+    return _decorate(func, 'function')
+
+
+def _decorate(func, kind):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not enabled:
+            return func(*args, **kwargs)
+
+        with record(func.__qualname__, kind):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+@contextmanager
+def record(name: str, kind: str = 'stage'):
+    '''
+    Record wall time, cpu time, peak rss and the tracemalloc peak of a block.
+
+    Records can be nested. The outermost record of each process also
+    collects a cProfile if profile_cprofile is set in the settings.
+
+    Parameters
+    ----------
+    name : str
+        Name of the record.
+    kind : str, optional
+        Either 'stage' or 'function', by default 'stage'.
+    '''
+    if not enabled:
+        yield
+        return
+
+    pid = os.getpid()
+    stack = _stacks.setdefault((pid, threading.get_ident()), [])
+
+    # tracemalloc and cProfile can only follow the main thread,
+    # records in io threads only get their wall and cpu time
+    main_thread = threading.current_thread() is threading.main_thread()
+    clock = time.process_time if main_thread else time.thread_time
+
+    if main_thread:
+        # keep the peak of the enclosing record before resetting it
+        if stack:
+            stack[-1]['peak'] = max(stack[-1]['peak'], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+    start_mem = tracemalloc.get_traced_memory()[0]
+
+    # only the outermost record can run a cProfile
+    profile = None
+    if main_thread and not stack and getattr(fm.settings, 'profile_cprofile', False):
+        profile = _cprofiles.setdefault((pid, name), cProfile.Profile())
+        profile.enable()
+
+    entry = {'peak': start_mem}
+    stack.append(entry)
+
+    start_wall = time.perf_counter()
+    start_cpu = clock()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - start_wall
+        cpu = clock() - start_cpu
+
+        stack.pop()
+
+        tracemalloc_peak = None
+        if main_thread:
+            peak = max(entry['peak'], tracemalloc.get_traced_memory()[1])
+            tracemalloc_peak = (peak - start_mem) / 1024**2
+
+            # pass the peak on to the enclosing record
+            if stack:
+                stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+            tracemalloc.reset_peak()
+
+        if profile is not None:
+            profile.disable()
+            dump_cprofile(profile, name, pid)
+
+        result = {
+            'name': name,
+            'kind': kind,
+            'pid': pid,
+            'thread': threading.current_thread().name,
+            'wall': wall,
+            'cpu': cpu,
+            'peak_rss_mb': peak_rss(),
+            'tracemalloc_peak_mb': tracemalloc_peak,
+        }
+
+        if pid == main_pid:
+            records.append(result)
+        else:
+            # pool workers cannot return records so they are written to disk
+            worker_path = os.path.join(fm.settings.profile_path, 'workers', run_id)
+            os.makedirs(worker_path, exist_ok=True)
+            with open(os.path.join(worker_path, f'{pid}.jsonl'), 'a') as f:
+                f.write(json.dumps(result) + '\n')
+
+
+def peak_rss() -> float | None:
+    '''Return the peak resident set size of this process in MB.'''
+    if resource is None:
+        return None
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # macos reports bytes and linux reports kilobytes
+    if sys.platform == 'darwin':
+        return rss / 1024**2
+
+    return rss / 1024
+
+
+def dump_cprofile(profile: cProfile.Profile, name: str, pid: int) -> None:
+    '''Write the cProfile stats of a stage (or of one worker) to disk.'''
+    os.makedirs(fm.settings.profile_path, exist_ok=True)
+
+    file_name = f'{name}.prof' if pid == main_pid else f'{name}_{pid}.prof'
+    profile.dump_stats(os.path.join(fm.settings.profile_path, file_name))
+
+
+def collect_worker_records() -> list:
+    '''
+    Read the records written by the pool workers of this run and remove the
+    workers folder, including the records of earlier runs that crashed.
+    '''
+    worker_path = os.path.join(fm.settings.profile_path, 'workers')
+
+    worker_records = []
+    for file_path in glob.glob(os.path.join(worker_path, run_id, '*.jsonl')):
+        with open(file_path) as f:
+            worker_records.extend(json.loads(line) for line in f if line.strip())
+
+    shutil.rmtree(worker_path, ignore_errors=True)
+
+    return worker_records
+
+
+def summarize(all_records: list) -> list:
+    '''
+    Aggregate the records by name.
+
+    Parameters
+    ----------
+    all_records : list
+        Records from the main process and the pool workers.
+
+    Returns
+    -------
+    list
+        One summary dictionary per record name, in order of first appearance.
+    '''
+    summary = {}
+    for rec in all_records:
+        entry = summary.setdefault(rec['name'], {
+            'name': rec['name'],
+            'kind': rec['kind'],
+            'calls': 0,
+            'wall': 0.0,
+            'cpu': 0.0,
+            'peak_rss_mb': None,
+            'tracemalloc_peak_mb': None,
+            'pids': set(),
+        })
+
+        entry['calls'] += 1
+        entry['wall'] += rec['wall']
+        entry['cpu'] += rec['cpu']
+        entry['pids'].add(rec['pid'])
+
+        # peaks are not available in every process or thread
+        for peak in ['peak_rss_mb', 'tracemalloc_peak_mb']:
+            if rec[peak] is not None:
+                entry[peak] = max(entry[peak] or 0.0, rec[peak])
+
+    # sets are not json serializable
+    for entry in summary.values():
+        entry['processes'] = len(entry.pop('pids'))
+
+    return list(summary.values())
+
+
+def report() -> None:
+    '''Print a summary table and save the json report.'''
+    if not enabled:
+        return
+
+    all_records = records + collect_worker_records()
+    summary = summarize(all_records)
+
+    table = Table(title='FlowManage profile')
+    table.add_column('Name', style='green')
+    table.add_column('Kind', style='magenta')
+    table.add_column('Calls', justify='right')
+    table.add_column('Procs', justify='right')
+    table.add_column('Wall [s]', justify='right')
+    table.add_column('CPU [s]', justify='right')
+    table.add_column('Peak RSS [MB]', justify='right')
+    table.add_column('Tracemalloc peak [MB]', justify='right')
+
+    for entry in summary:
+        peak_rss_mb = '-' if entry['peak_rss_mb'] is None else f"{entry['peak_rss_mb']:.1f}"
+        tracemalloc_peak_mb = '-' if entry['tracemalloc_peak_mb'] is None else f"{entry['tracemalloc_peak_mb']:.1f}"
+        table.add_row(entry['name'], entry['kind'], str(entry['calls']), str(entry['processes']),
+                      f"{entry['wall']:.3f}", f"{entry['cpu']:.3f}", peak_rss_mb, tracemalloc_peak_mb)
+
+    fm.con.print(table)
+
+    # save the json report
+    os.makedirs(fm.settings.profile_path, exist_ok=True)
+    report_path = os.path.join(fm.settings.profile_path, 'profile.json')
+    with open(report_path, 'w') as fp:
+        json.dump({'summary': summary, 'records': all_records}, fp, indent=4)
+
+    fm.con.print(f'[magenta]Saving profile report to [bold green]{report_path}[/] ...')
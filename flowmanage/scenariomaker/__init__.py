@@ -1 +1,2 @@
-from.scenariomaker import ScenarioMaker
\ No newline at end of file
+from .scenariomaker import ScenarioMaker
+from .validator import ScenarioValidator
\ No newline at end of file
@@ -1,31 +1,33 @@
 import os
+import time
+import hashlib
+import random
+import socket
+import threading
+from queue import Queue
 from multiprocessing import Pool as ThreadPool
 from rich.progress import track
 
-import osmnx as ox
-import numpy as np
 import pandas as pd
 
 import flowmanage as fm
-class ScenarioMaker:
+from flowmanage import profiler, geodata
+from flowmanage.workqueue import WorkQueue
+from flowmanage.intentionmaker.intentionindex import read_window, spawn_seconds
+from flowmanage.scenariomaker.scnwriter import ScnWriter, suffixes, zstandard
+
+class ScenarioMaker(geodata.PrefetchedData):
     def __init__(self) -> None:
 
         # get the flight intention files to make scenarios
         self.intention_folder = fm.settings.intentions
-        self.intention_files = os.listdir(fm.settings.intentions)
+        self.intention_files = self.get_intention_files()
 
-        if not self.intention_files:
+        # the intention files can still be created by the intention maker
+        if not self.intention_files and not fm.settings.demand_intentions:
             fm.con.print('[red bold]No intention files found!')
             fm.con.print("[red bold]Try:[/] [green]python FlowManage.py --intention")
             quit()
-        # remove any hidden files
-        self.intention_files = [file for file in self.intention_files if not file.startswith('.')]
-
-        # read osmx graph from data
-        self.G = ox.load_graphml(fm.settings.graph_path)
-
-        # get nodes and edges
-        self.nodes, self.edges = ox.graph_to_gdfs(self.G)
 
         # process the rest of settings
         self.intention_cols = fm.settings.intention_cols
@@ -33,7 +35,16 @@ class ScenarioMaker:
         self.default_values = fm.settings.default_values
         self.scenario_header = fm.settings.scenario_header
         self.scenario_folder = fm.settings.scenarios
+        self.scenario_window = fm.settings.scenario_window
+        self.compression = fm.settings.scenario_compression
+        self.compression_level = fm.settings.scenario_compression_level
+
+        if self.compression == 'zst' and zstandard is None:
+            fm.con.print('[red bold]zstandard is not installed!')
+            fm.con.print("[red bold]Try:[/] [green]pip install zstandard[/] [red bold]or[/] [green]scenario_compression = 'gz'")
+            quit()
 
+    @profiler.stage
     def process(self, multi: int | None = None) -> None:
         """Main scenario maker process.
         Args:
@@ -42,6 +53,10 @@ class ScenarioMaker:
 
         fm.con.print('[magenta]Creating scenarios...')
 
+        # list the intention files again in case the intention maker created them
+        self.intention_files = self.get_intention_files()
+        os.makedirs(self.scenario_folder, exist_ok=True)
+
         if multi:
                 pool = ThreadPool(multi)
                 pool.map(self.create_scen, self.intention_files)
@@ -54,37 +69,232 @@ class ScenarioMaker:
                 # create the scenario file
                 self.create_scen(intention_file)
 
+    @profiler.stage
+    def process_queue(self, multi: int | None = None) -> None:
+        """Create scenarios together with other FlowManage processes that share the
+        scenario folder, also on other hosts.
+
+        Every worker claims intention files through the work queue in the hidden
+        .queue folder of the scenario folder until all files are done. Start as
+        many processes with --queue as there are nodes, no server is needed.
+
+        Args:
+            multi (int | None, optional): Number of workers in this process. Defaults to None.
+        """
+
+        fm.con.print('[magenta]Creating scenarios from the work queue...')
+
+        # list the intention files again in case the intention maker created them
+        self.intention_files = self.get_intention_files()
+        os.makedirs(self.scenario_folder, exist_ok=True)
+
+        if multi:
+            pool = ThreadPool(multi)
+            n_created = pool.map(self.queue_worker, range(multi))
+            pool.close()
+        else:
+            n_created = [self.queue_worker(0)]
+
+        fm.con.print(f'[magenta]All {len(self.intention_files)} scenarios are done, '
+                     f'{sum(n_created)} of them by this process.')
+
+    def queue_worker(self, worker: int) -> int:
+        """Claim and create scenarios until every intention file is done.
+
+        Args:
+            worker (int): number of the worker in this process.
+
+        Returns:
+            int: number of scenarios created by this worker.
+        """
+        queue = WorkQueue(os.path.join(self.scenario_folder, '.queue'), fm.settings.queue_lease,
+                          fm.settings.queue_heartbeat)
+
+        # a changed intention file or changed scenario settings make a new job
+        settings = (self.scenario_window, self.compression, self.compression_level, self.scenario_header,
+                    self.scen_cols, self.default_values)
+        settings_hash = hashlib.blake2b(repr(settings).encode(), digest_size=8).hexdigest()
+
+        jobs = {file: f'{os.stat(os.path.join(self.intention_folder, file)).st_mtime_ns}.{settings_hash}'
+                for file in self.intention_files}
+
+        # a job whose scenario was deleted is not done, the scenario is written before the done marker
+        for intention_file in self.intention_files:
+            scenario_file = intention_file.replace('csv','scn') + suffixes[self.compression]
+            if not os.path.isfile(os.path.join(self.scenario_folder, scenario_file)):
+                queue.reset(intention_file)
+
+        n_created = 0
+        queue.start()
+        try:
+            while pending := queue.pending(jobs):
+                # every worker tries the files in another order so they rarely race for a claim
+                random.shuffle(pending)
+
+                claimed = False
+                for intention_file in pending:
+                    if not queue.claim(intention_file, jobs[intention_file]):
+                        continue
+
+                    self.create_scen(intention_file)
+                    queue.mark_done(intention_file, jobs[intention_file])
+
+                    fm.con.print(f'[magenta]Worker {worker} created the scenario of [bold green]{intention_file}')
+                    n_created += 1
+                    claimed = True
+
+                # the other files are claimed, wait until they are done or their lease expires
+                if not claimed:
+                    time.sleep(queue.heartbeat)
+        finally:
+            queue.stop()
+
+        return n_created
+
+    @profiler.stage
+    def process_intentions(self, batches) -> None:
+        """Create scenarios from intentions in memory instead of intention files.
+
+        The batches are produced in a background thread into a queue of
+        fm.settings.handoff_queue_size batches, so sampling and writing overlap
+        while at most that many batches wait in memory.
+
+        Args:
+            batches (Iterator[tuple]): intention file names with their intentions,
+                like IntentionMaker.intention_batches().
+        """
+
+        fm.con.print('[magenta]Creating scenarios from memory...')
+
+        os.makedirs(self.scenario_folder, exist_ok=True)
+
+        for intention_file, scen_df in bounded(batches, fm.settings.handoff_queue_size):
+
+            # only keep the rows in the window if there is one
+            if self.scenario_window:
+                spawn_time = spawn_seconds(scen_df['spawn_time'])
+                scen_df = scen_df[(spawn_time >= self.scenario_window[0]) & (spawn_time < self.scenario_window[1])]
+
+            scenario_path = os.path.join(self.scenario_folder, intention_file.replace('csv','scn'))
+            scenario_path = write_scenario(scen_df, scenario_path, self.scen_cols, self.default_values,
+                                           self.scenario_header, self.compression, self.compression_level)
+
+            fm.con.print(f'[magenta]Saving scenario to [bold green]{os.path.basename(scenario_path)}[/] ...')
+
+    def get_intention_files(self) -> list:
+        """Get the intention files in the intention folder without any hidden files."""
+        if not os.path.isdir(self.intention_folder):
+            return []
+
+        return [file for file in os.listdir(self.intention_folder) if not file.startswith('.')]
+
+    @profiler.hotpath
     def create_scen(self, intention_file: str) -> None:
         """Create the scenario file from the intention file."""
         
         # read the intention file
         file_path = os.path.join(self.intention_folder, intention_file)
 
-        # create the dataframe
-        scen_df = pd.read_csv(file_path, names=self.intention_cols)
+        # create the dataframe, only with the rows in the window if there is one
+        if self.scenario_window:
+            scen_df = read_window(file_path, *self.scenario_window, names=self.intention_cols)
+        else:
+            scen_df = pd.read_csv(file_path, names=self.intention_cols)
         
-        # see if any columns are missing from intention file
-        missing_cols = list(set(self.scen_cols) - set(self.intention_cols))
+        # write the scenario with the same name as the intention file
+        scenario_file_name = intention_file.replace('csv','scn')
 
-        # add them to the dataframe
-        if missing_cols:
-            for col in missing_cols:
-                    scen_df[col] = self.default_values[col]
+        scenario_path = os.path.join(self.scenario_folder, scenario_file_name)
+        write_scenario(scen_df, scenario_path, self.scen_cols, self.default_values, self.scenario_header,
+                       self.compression, self.compression_level)
 
-        # create a column with spawn time + crecmd
-        scen_df['crecmd'] = scen_df['spawn_time'] + '>' + scen_df['crecmd']
 
-        # remove spawn time column
-        scen_df.drop('spawn_time', axis=1, inplace=True)
+def bounded(iterable, maxsize: int):
+    """Iterate over iterable while a background thread produces the next items into a
+    queue of at most maxsize items. Errors of the producer are raised in the consumer."""
+    queue = Queue(maxsize=max(1, maxsize))
+    done = object()
+    errors = []
 
-        # save as df to csv
-        scenario_file_name = intention_file.replace('csv','scn')
+    def produce():
+        try:
+            for item in iterable:
+                queue.put(item)
+        except BaseException as exc:
+            errors.append(exc)
+        finally:
+            queue.put(done)
 
-        scenario_path = os.path.join(self.scenario_folder, scenario_file_name)
-        scen_df.to_csv(scenario_path, index=False, header=False, columns=self.scen_cols)
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+
+    while (item := queue.get()) is not done:
+        yield item
+
+    producer.join()
+
+    if errors:
+        raise errors[0]
+
+
+def write_scenario(scen_df: pd.DataFrame, scenario_path: str, scen_cols: list, default_values: dict,
+                   scenario_header: list, compression: str | None = None, level: int | None = None,
+                   chunk_rows: int = 100_000) -> str:
+    """Write flight intentions as a scenario file.
+
+    The header and the lines are written in one pass. The lines are formatted in
+    blocks of chunk_rows while the previous block is compressed in the background.
+    The file is written under a hidden name and renamed when it is complete, so
+    readers and other workers of the work queue never see a partial scenario.
+
+    Args:
+        scen_df (pd.DataFrame): flight intentions with a spawn_time column.
+        scenario_path (str): path of the scenario file without compression suffix.
+        scen_cols (list): columns of the creation commands.
+        default_values (dict): values of the scen_cols that the intentions do not have.
+        scenario_header (list): lines at the top of the scenario file.
+        compression (str | None, optional): None, 'gz' or 'zst'. Defaults to None.
+        level (int | None, optional): compression level. Defaults to the default level.
+        chunk_rows (int, optional): number of lines formatted at once. Defaults to 100_000.
+
+    Returns:
+        str: path of the written file including the compression suffix.
+    """
+    scen_df = scen_df.copy()
+
+    # see if any columns are missing from intention file
+    missing_cols = list(set(scen_cols) - set(scen_df.columns))
+
+    # add them to the dataframe
+    if missing_cols:
+        for col in missing_cols:
+            scen_df[col] = default_values[col]
+
+    # create a column with spawn time + crecmd
+    scen_df['crecmd'] = scen_df['spawn_time'] + '>' + scen_df['crecmd']
+
+    # remove spawn time column
+    scen_df.drop('spawn_time', axis=1, inplace=True)
+
+    scenario_path += suffixes[compression]
+
+    folder, file_name = os.path.split(scenario_path)
+    part_path = os.path.join(folder, f'.{file_name}.{socket.gethostname()}.{os.getpid()}.part')
+
+    # write the header first and then the lines block by block
+    try:
+        with ScnWriter(part_path, compression, level) as writer:
+            writer.write(''.join(scenario_header))
+
+            for start in range(0, len(scen_df), chunk_rows):
+                writer.write(scen_df.iloc[start:start + chunk_rows].to_csv(index=False, header=False,
+                                                                           columns=scen_cols))
+    except BaseException:
+        # do not leave a partial scenario behind
+        if os.path.exists(part_path):
+            os.unlink(part_path)
+        raise
+
+    os.replace(part_path, scenario_path)
 
-        # add the header to the file
-        with open(scenario_path, 'r+') as f:
-            content = f.read()
-            f.seek(0, 0)
-            f.write(''.join(self.scenario_header) + content)
\ No newline at end of file
+    return scenario_path
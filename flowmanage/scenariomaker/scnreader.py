@@ -0,0 +1,66 @@
+import os
+
+import pandas as pd
+
+import flowmanage as fm
+from flowmanage.scenariomaker.scnwriter import suffixes
+
+
+def read_scn(file_path: str, chunksize: int | None = None):
+    """Read the aircraft creation commands of a scenario file.
+
+    The scenario is parsed with the C reader of pandas using the columns in
+    fm.settings.scen_cols. Lines that are not a CRE command (like the header)
+    are dropped. Files ending in .gz or .zst are decompressed while they are read.
+
+    Args:
+        file_path (str): path of the scenario file (.scn, .scn.gz or .scn.zst).
+        chunksize (int | None, optional): If given, return an iterator over
+            dataframes with at most chunksize lines each. Defaults to None.
+
+    Returns:
+        pd.DataFrame | Iterator[pd.DataFrame]: creation commands with a
+            'spawn_time' column in seconds and the fm.settings.scen_cols columns.
+    """
+    reader = pd.read_csv(file_path, header=None, names=fm.settings.scen_cols, dtype={'acid': str},
+                         chunksize=chunksize, compression='infer')
+
+    if chunksize is None:
+        return parse_cre(reader)
+
+    return (parse_cre(chunk) for chunk in reader)
+
+
+def parse_cre(scen_df: pd.DataFrame) -> pd.DataFrame:
+    """Keep the CRE commands of a scenario dataframe and split off their spawn time.
+
+    Args:
+        scen_df (pd.DataFrame): scenario lines with the fm.settings.scen_cols columns.
+
+    Returns:
+        pd.DataFrame: creation commands with a 'spawn_time' column in seconds.
+    """
+    # the first column is 'HH:MM:SS>CRECMD'
+    time_cmd = scen_df['crecmd'].str.split('>', n=1, expand=True)
+
+    # the header has no commands if it is empty
+    if time_cmd.shape[1] < 2:
+        return scen_df.iloc[:0].assign(spawn_time=pd.Series(dtype=float))
+
+    is_cre = time_cmd[1].str.startswith('CRE', na=False).to_numpy()
+
+    cre_df = scen_df[is_cre].copy()
+    cre_df['crecmd'] = time_cmd.loc[is_cre, 1]
+    cre_df['spawn_time'] = pd.to_timedelta(time_cmd.loc[is_cre, 0]).dt.total_seconds()
+
+    return cre_df
+
+
+def scenario_name(file_name: str) -> str:
+    """Name of a scenario file without the .scn and compression extensions."""
+    for suffix in suffixes.values():
+        if suffix and file_name.endswith(suffix):
+            file_name = file_name[:-len(suffix)]
+            break
+
+    return os.path.splitext(file_name)[0]
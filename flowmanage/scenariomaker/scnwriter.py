@@ -0,0 +1,96 @@
+import zlib
+import threading
+from queue import Queue
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# file extension of each scenario compression
+suffixes = {None: '', 'gz': '.gz', 'zst': '.zst'}
+
+
+class ScnWriter:
+    """Write a scenario file, optionally compressed as gzip or zstandard.
+
+    The text is encoded in the calling thread and compressed and written in a
+    background thread, so formatting the next lines overlaps with compressing the
+    previous ones. Both compressors release the GIL while they work. At most
+    queue_size blocks wait for the background thread.
+
+    Use as a context manager:
+
+        with ScnWriter('scenario.scn.gz', 'gz', 6) as writer:
+            writer.write(lines)
+    """
+
+    def __init__(self, file_path: str, compression: str | None = None, level: int | None = None,
+                 queue_size: int = 4) -> None:
+        """
+        Args:
+            file_path (str): path of the scenario file including the compression suffix.
+            compression (str | None, optional): None, 'gz' or 'zst'. Defaults to None.
+            level (int | None, optional): compression level. Defaults to the default
+                level of the compressor.
+            queue_size (int, optional): number of blocks that can wait to be written. Defaults to 4.
+        """
+        if compression == 'gz':
+            # wbits 31 writes a gzip header and trailer
+            self.compressor = zlib.compressobj(-1 if level is None else level, zlib.DEFLATED, 31)
+        elif compression == 'zst':
+            if zstandard is None:
+                raise ImportError('zstandard is needed for .scn.zst output, install it or use gz compression')
+            self.compressor = zstandard.ZstdCompressor(level=3 if level is None else level).compressobj()
+        elif compression is None:
+            self.compressor = None
+        else:
+            raise ValueError(f'unknown scenario compression {compression!r}, use None, gz or zst')
+
+        self.file = open(file_path, 'wb')
+        self.queue = Queue(maxsize=queue_size)
+        self.errors = []
+
+        self.thread = threading.Thread(target=self._write_blocks, daemon=True)
+        self.thread.start()
+
+    def write(self, text: str) -> None:
+        """Queue text to be compressed and written."""
+        if self.errors:
+            raise self.errors[0]
+
+        self.queue.put(text.encode())
+
+    def close(self) -> None:
+        """Write the remaining blocks and close the file."""
+        self.queue.put(None)
+        self.thread.join()
+
+        if self.errors:
+            raise self.errors[0]
+
+    def _write_blocks(self) -> None:
+        closed = False
+        try:
+            while (block := self.queue.get()) is not None:
+                if self.compressor is not None:
+                    block = self.compressor.compress(block)
+                self.file.write(block)
+
+            closed = True
+            if self.compressor is not None:
+                self.file.write(self.compressor.flush())
+        except Exception as exc:
+            self.errors.append(exc)
+
+            # keep taking blocks so write() and close() never block on a full queue
+            while not closed and self.queue.get() is not None:
+                pass
+        finally:
+            self.file.close()
+
+    def __enter__(self) -> 'ScnWriter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
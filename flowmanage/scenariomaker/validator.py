@@ -0,0 +1,133 @@
+import os
+import json
+from multiprocessing import Pool as ThreadPool
+from rich.progress import track
+from rich.table import Table
+
+import numpy as np
+import pandas as pd
+import shapely
+
+import flowmanage as fm
+from flowmanage import profiler, geodata
+from flowmanage.scenariomaker.scnreader import read_scn
+
+
+class ScenarioValidator(geodata.PrefetchedData):
+    def __init__(self) -> None:
+
+        # get the scenario files to validate
+        self.scenario_folder = fm.settings.scenarios
+        self.scenario_files = [file for file in os.listdir(self.scenario_folder) if not file.startswith('.')]
+
+        if not self.scenario_files:
+            fm.con.print('[red bold]No scenario files found!')
+            fm.con.print("[red bold]Try:[/] [green]python FlowManage.py --scenario")
+            quit()
+
+        # get the city border (only the geometry is needed)
+        border_path = os.path.join(fm.settings.geo_data, 'borders', 'city_border.gpkg')
+        self.prefetch('city_border', geodata.read_layer, border_path, columns=[])
+
+        # process the rest of settings
+        self.chunksize = fm.settings.validate_chunksize
+        self.validation_path = fm.settings.validation_path
+
+    @profiler.stage
+    def process(self, multi: int | None = None) -> None:
+        """Validate all scenario files and save the results.
+        Args:
+            multi (int | None, optional): Number of workers to use. Defaults to None.
+        """
+
+        fm.con.print('[magenta]Validating scenarios...')
+
+        # the border in the coordinates of the scenarios
+        self.border = self.city_border.to_crs(epsg=4326).union_all()
+
+        if multi:
+            pool = ThreadPool(multi)
+            results = pool.map(self.validate, self.scenario_files)
+            pool.close()
+        else:
+            results = [self.validate(scenario_file) for scenario_file in
+                       track(self.scenario_files, description="[magenta]Processing...", console=fm.con)]
+
+        self.print_results(results)
+
+        # save the results of all scenarios
+        os.makedirs(os.path.dirname(self.validation_path) or '.', exist_ok=True)
+        with open(self.validation_path, 'w') as fp:
+            json.dump(results, fp, indent=4)
+
+        fm.con.print(f'[magenta]Saving validation to [bold green]{self.validation_path}[/] ...')
+
+    @profiler.hotpath
+    def validate(self, scenario_file: str) -> dict:
+        """Validate one scenario file. The file is streamed in chunks of self.chunksize lines
+        and every check runs on a whole chunk at once. Only a 64 bit hash per aircraft id
+        is kept between chunks.
+
+        The checks are:
+            - spawn times never decrease.
+            - origins and destinations are inside the city border.
+            - aircraft ids are unique.
+
+        Args:
+            scenario_file (str): name of the scenario file.
+
+        Returns:
+            dict: number of flights and of failed checks of the scenario.
+        """
+        # prepare the border for fast point in polygon checks
+        shapely.prepare(self.border)
+
+        result = {'scenario': scenario_file, 'flights': 0, 'non_monotonic': 0, 'outside_border': 0,
+                  'duplicate_acids': 0}
+
+        last_time = -np.inf
+        acid_hashes = []
+        for flights in read_scn(os.path.join(self.scenario_folder, scenario_file), self.chunksize):
+            result['flights'] += len(flights)
+
+            if not len(flights):
+                continue
+
+            # the spawn time must not be smaller than the one of the previous line
+            spawn_time = flights['spawn_time'].to_numpy()
+            result['non_monotonic'] += int(np.count_nonzero(np.diff(spawn_time, prepend=last_time) < 0))
+            last_time = spawn_time[-1]
+
+            # origins and destinations must be inside the border
+            inside = (shapely.contains_xy(self.border, flights['origin_lon'].to_numpy(), flights['origin_lat'].to_numpy())
+                      & shapely.contains_xy(self.border, flights['destination_lon'].to_numpy(),
+                                            flights['destination_lat'].to_numpy()))
+            result['outside_border'] += int(np.count_nonzero(~inside))
+
+            acid_hashes.append(pd.util.hash_array(flights['acid'].to_numpy(dtype=str)))
+
+        # aircraft ids must be unique over the whole file
+        if acid_hashes:
+            acid_hashes = np.sort(np.concatenate(acid_hashes))
+            result['duplicate_acids'] = int(np.count_nonzero(acid_hashes[1:] == acid_hashes[:-1]))
+
+        result['valid'] = not (result['non_monotonic'] or result['outside_border'] or result['duplicate_acids'])
+
+        return result
+
+    def print_results(self, results: list) -> None:
+        """Print the validation of all scenarios as a table."""
+        table = Table(title='Scenario validation')
+        table.add_column('Scenario', style='green')
+        table.add_column('Flights', justify='right')
+        table.add_column('Non monotonic', justify='right')
+        table.add_column('Outside border', justify='right')
+        table.add_column('Duplicate ACIDs', justify='right')
+        table.add_column('Status')
+
+        for result in results:
+            status = '[green]valid' if result['valid'] else '[red]invalid'
+            table.add_row(result['scenario'], str(result['flights']), str(result['non_monotonic']),
+                          str(result['outside_border']), str(result['duplicate_acids']), status)
+
+        fm.con.print(table)
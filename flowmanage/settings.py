@@ -3,13 +3,15 @@ import os
 import flowmanage as fm
 
 
-def init() -> None:
-    '''Initialize configuration.'''
+def init(cfgfile: str = 'settings.cfg', overrides: dict | None = None) -> None:
+    '''Initialize configuration. Settings in overrides replace the ones in cfgfile.'''
 
     # get config file path
-    cfgfile = os.path.join('', 'settings.cfg')
+    cfgfile = os.path.join('', cfgfile)
 
     fm.con.print(f'[magenta]Reading config from {cfgfile}')
 
     exec(compile(open(cfgfile).read(), cfgfile, 'exec'), globals())
 
+    if overrides:
+        globals().update(overrides)
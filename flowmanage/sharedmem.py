@@ -0,0 +1,108 @@
+'''FlowManage shared memory module'''
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# shared memory blocks of this process by name, created by publish() or attached by init_worker()
+_blocks = {}
+
+
+def publish(name: str, array: np.ndarray) -> dict:
+    '''
+    Copy an array to a new shared memory block once so pool workers can attach
+    to it without pickling. A block that was published with the same name is
+    released first.
+
+    Parameters
+    ----------
+    name : str
+        Name of the array in the registry.
+    array : np.ndarray
+        Read-only data to share.
+
+    Returns
+    -------
+    dict
+        {name: spec} to pass to init_worker().
+    '''
+    release(name)
+
+    array = np.ascontiguousarray(array)
+
+    # blocks can not be empty
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    shared[...] = array
+    shared.flags.writeable = False
+
+    _blocks[name] = (shm, shared, True)
+
+    return {name: spec(name)}
+
+
+def publish_graph(graph) -> dict:
+    '''
+    Publish the matrix of a CSRGraph for scipy.sparse.csgraph, which pool
+    workers rebuild with csrgraph.shared_matrix().
+
+    Returns
+    -------
+    dict
+        {name: spec} of 'csgraph_indptr', 'csgraph_indices' and 'csgraph_weights'.
+    '''
+    matrix = graph.to_scipy()
+    specs = publish('csgraph_indptr', matrix.indptr)
+    specs.update(publish('csgraph_indices', matrix.indices))
+    specs.update(publish('csgraph_weights', matrix.data))
+
+    return specs
+
+
+def spec(name: str) -> dict:
+    '''Description of a published array that is enough to attach to it.'''
+    shm, array, _ = _blocks[name]
+
+    return {'shm_name': shm.name, 'shape': array.shape, 'dtype': array.dtype.str}
+
+
+def attach(array_spec: dict) -> tuple:
+    '''Attach to a published array without copying it.'''
+    shm = shared_memory.SharedMemory(name=array_spec['shm_name'])
+    array = np.ndarray(array_spec['shape'], dtype=np.dtype(array_spec['dtype']), buffer=shm.buf)
+    array.flags.writeable = False
+
+    return shm, array
+
+
+def init_worker(specs: dict) -> None:
+    '''Pool initializer that attaches the worker to the published arrays in specs.'''
+    for name, array_spec in specs.items():
+        # forked workers inherit the blocks of the parent
+        if name in _blocks and _blocks[name][0].name == array_spec['shm_name']:
+            continue
+
+        _blocks[name] = (*attach(array_spec), False)
+
+
+def get(name: str) -> np.ndarray:
+    '''Get a published or attached array.'''
+    if name not in _blocks:
+        raise KeyError(f'{name!r} is not published, call publish() or init_worker() first')
+
+    return _blocks[name][1]
+
+
+def release(*names: str) -> None:
+    '''
+    Release the given arrays, or all of them if no names are given. Blocks
+    published by this process are also removed from the system.
+    '''
+    for name in (names or list(_blocks)):
+        if name not in _blocks:
+            continue
+
+        shm, _, owner = _blocks.pop(name)
+        shm.close()
+
+        if owner:
+            shm.unlink()
@@ -0,0 +1,138 @@
+'''FlowManage spatial index cache module'''
+import os
+import hashlib
+
+import numpy as np
+import shapely
+from shapely import STRtree
+
+# trees that were built in this process, by geometry hash
+_trees = {}
+
+# query results kept in a cache folder
+MAX_CACHED = 32
+
+
+def geometry_hash(geoms) -> str:
+    '''Content hash of a geometry array.'''
+    wkb = shapely.to_wkb(np.asarray(geoms), hex=False)
+
+    return hashlib.blake2b(b''.join(wkb), digest_size=16).hexdigest()
+
+
+class SpatialIndex:
+    '''
+    STRtree over a geometry array that keeps the results of its bulk queries
+    on disk, keyed by the content hash of the indexed and queried geometries.
+
+    Shapely rebuilds an STRtree when it is unpickled, so instead of the tree
+    the query results are saved. Repeated studies on the same city reload
+    them with a single np.load and never build or query the tree.
+
+    The queried geometries are hashed on every query, also when the result is
+    cached, so a cache folder only pays off for queries that repeat, like the
+    grid cells. At most MAX_CACHED results are kept in a cache folder,
+    the least recently used ones are removed first.
+    '''
+
+    def __init__(self, geoms, cache_dir: str | None = None) -> None:
+        '''
+        Parameters
+        ----------
+        geoms : array_like
+            Geometries to index.
+        cache_dir : str | None, optional
+            Folder to keep the query results in. Nothing is saved if None, by default None.
+        '''
+        self.geoms = np.asarray(geoms)
+        self.key = geometry_hash(self.geoms)
+        self.cache_dir = cache_dir
+
+    @property
+    def tree(self) -> STRtree:
+        '''The STRtree, built at most once per process for the same geometries.'''
+        if self.key not in _trees:
+            _trees[self.key] = STRtree(self.geoms)
+
+        return _trees[self.key]
+
+    def query(self, geoms, predicate: str | None = None) -> np.ndarray:
+        '''
+        Bulk STRtree query.
+
+        Parameters
+        ----------
+        geoms : array_like
+            Geometries to query the index with.
+        predicate : str | None, optional
+            Shapely predicate (e.g. 'contains', 'intersects'), by default None.
+
+        Returns
+        -------
+        np.ndarray
+            Array of shape (2, n) with the indices of geoms and the indices of
+            the indexed geometries that satisfy the predicate.
+        '''
+        geoms = np.asarray(geoms)
+
+        return self._cached(f'query_{predicate}', geoms,
+                            lambda: self.tree.query(geoms, predicate=predicate))
+
+    def nearest(self, geoms) -> np.ndarray:
+        '''
+        Bulk nearest neighbour query.
+
+        Returns
+        -------
+        np.ndarray
+            Array of shape (2, n) with the indices of geoms and the indices of
+            the nearest indexed geometries.
+        '''
+        geoms = np.asarray(geoms)
+
+        return self._cached('nearest', geoms, lambda: self.tree.query_nearest(geoms))
+
+    def _cached(self, name: str, geoms: np.ndarray, func) -> np.ndarray:
+        # run the query if the result is not in the cache
+        if self.cache_dir is None:
+            return func()
+
+        file_path = os.path.join(self.cache_dir, f'{self.key}_{geometry_hash(geoms)}_{name}.npy')
+
+        try:
+            # a used result is the newest again
+            os.utime(file_path)
+            return np.load(file_path)
+        except FileNotFoundError:
+            pass
+
+        result = func()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # write to a temporary file first so parallel runs never read half a file
+        tmp_path = f'{file_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, result)
+        os.replace(tmp_path, file_path)
+
+        self._prune()
+
+        return result
+
+    def _prune(self) -> None:
+        # remove the oldest results beyond MAX_CACHED
+        files = {}
+        for entry in os.scandir(self.cache_dir):
+            try:
+                if entry.name.endswith('.npy'):
+                    files[entry.path] = entry.stat().st_mtime
+            except FileNotFoundError:
+                # removed by a parallel run
+                pass
+
+        for file_path in sorted(files, key=files.get)[:-MAX_CACHED]:
+            try:
+                os.unlink(file_path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,249 @@
+'''FlowManage watch module'''
+import os
+import re
+import time
+import inspect
+import importlib.util
+
+import flowmanage as fm
+from flowmanage import geodata
+
+# stages of each mode in the order they run
+mode_stages = {
+    'all': ['intention', 'airspace', 'scenario'],
+    'intention': ['intention'],
+    'airspace': ['airspace'],
+    'scenario': ['scenario'],
+    'odpoints': ['odpoints'],
+    'heights': ['heights'],
+    'validate': ['validate'],
+    'conflicts': ['conflicts'],
+    'occupancy': ['occupancy'],
+}
+
+# global object of each stage in flowmanage
+stage_objects = {'intention': 'inten', 'airspace': 'air', 'scenario': 'scen', 'odpoints': 'odpoints',
+                 'heights': 'heights', 'validate': 'validator', 'conflicts': 'conflicts',
+                 'occupancy': 'occupancy'}
+
+# modules whose settings each stage reads
+stage_modules = {
+    'intention': ['flowmanage.intentionmaker.intentionmaker', 'flowmanage.intentionmaker.intentionindex'],
+    'airspace': ['flowmanage.airspacedesign.airspacedesign'],
+    'scenario': ['flowmanage.scenariomaker.scenariomaker', 'flowmanage.intentionmaker.intentionindex'],
+    'odpoints': ['flowmanage.odpoints.streetcenterpoints'],
+    'heights': ['flowmanage.airspacedesign.buildingheights'],
+    'validate': ['flowmanage.scenariomaker.validator', 'flowmanage.scenariomaker.scnreader'],
+    'conflicts': ['flowmanage.analysis.conflicts', 'flowmanage.scenariomaker.scnreader'],
+    'occupancy': ['flowmanage.analysis.occupancy', 'flowmanage.scenariomaker.scnreader'],
+}
+
+# modules whose settings change how every stage reads its data
+shared_modules = ['flowmanage.geodata', 'flowmanage.csrgraph', 'flowmanage.sindex']
+
+# stages that read the output of another stage
+downstream = {'intention': ['scenario'], 'scenario': ['validate', 'conflicts', 'occupancy'],
+              'airspace': ['occupancy']}
+
+
+def run(mode: str = 'all', multi: int | None = None, cfgfile: str = 'settings.cfg') -> None:
+    '''
+    Run the selected stages and keep running them whenever the config file or
+    one of the input folders changes.
+
+    The process stays alive so the datasets read by geodata and the spatial
+    indices stay in memory between runs. After a change only the reads of the
+    changed files are dropped and only the stages that use a changed setting or
+    file, and the stages after them, run again.
+
+    Parameters
+    ----------
+    mode : str, optional
+        Modules to run, see fm.run(), by default 'all'.
+    multi : int | None, optional
+        Number of workers, by default None.
+    cfgfile : str, optional
+        Config file to watch, by default 'settings.cfg'.
+    '''
+    if mode not in mode_stages:
+        fm.con.print(f'[red bold]--watch does not support the {mode} mode!')
+        return
+
+    stages = mode_stages[mode]
+
+    fm.settings.init(cfgfile)
+    cfg_mtime = os.stat(cfgfile).st_mtime_ns
+    settings = settings_snapshot()
+    used_settings = {stage: module_settings(stage_modules[stage]) for stage in stages}
+    shared_settings = module_settings(shared_modules)
+
+    run_stages(stages, multi, cfgfile, 1)
+
+    files = input_mtimes(stages)
+    n_run = 1
+
+    fm.con.print(f'[magenta]Watching [bold green]{cfgfile}[/] and the input folders (Ctrl+C to stop)...')
+
+    try:
+        while True:
+            time.sleep(fm.settings.watch_interval)
+
+            changed_settings = set()
+            if os.stat(cfgfile).st_mtime_ns != cfg_mtime:
+                cfg_mtime = os.stat(cfgfile).st_mtime_ns
+
+                try:
+                    fm.settings.init(cfgfile)
+                except Exception as exc:
+                    fm.con.print(f'[red]Could not read {cfgfile}: {exc}')
+                    continue
+
+                new_settings = settings_snapshot()
+                changed_settings = {key for key in settings.keys() | new_settings.keys()
+                                    if settings.get(key) != new_settings.get(key)}
+                settings = new_settings
+
+            new_files = input_mtimes(stages)
+            changed_files = {path for path in files.keys() | new_files.keys() if files.get(path) != new_files.get(path)}
+
+            if not changed_settings and not changed_files:
+                continue
+
+            # drop the data that is out of date, the rest stays in memory
+            if changed_settings & shared_settings or constrained_airspace() in changed_files:
+                geodata.clear()
+            elif changed_files:
+                geodata.clear(list(changed_files))
+
+            affected = affected_stages(stages, changed_settings, changed_files, used_settings, shared_settings)
+
+            fm.con.print(f'[magenta]Changed settings: {", ".join(sorted(changed_settings)) or "-"}')
+            fm.con.print(f'[magenta]Changed files: {", ".join(sorted(changed_files)) or "-"}')
+
+            if affected:
+                n_run += 1
+                run_stages(affected, multi, cfgfile, n_run)
+            else:
+                fm.con.print('[magenta]No stage uses the changes.')
+
+            # files written by the stages are not changes
+            files = input_mtimes(stages)
+
+    except KeyboardInterrupt:
+        fm.con.print('[magenta]Stopped watching.')
+
+
+def run_stages(stages: list, multi: int | None, cfgfile: str, n_run: int) -> None:
+    '''Run the stages in order and print the time of each one.'''
+    times = []
+    start = time.perf_counter()
+
+    for stage in stages:
+        stage_start = time.perf_counter()
+
+        try:
+            fm.init(stage, cfgfile)
+            fm.run(stage, multi)
+        except (Exception, SystemExit) as exc:
+            # keep watching so the input can be fixed
+            fm.con.print(f'[red]Stage {stage} failed: {exc!r}')
+            break
+
+        times.append(f'{stage} {time.perf_counter() - stage_start:.1f} s')
+
+    fm.con.print(f'[magenta]Run {n_run} finished in [bold]{time.perf_counter() - start:.1f} s[/] ({", ".join(times)})')
+
+
+def affected_stages(stages: list, changed_settings: set, changed_files: set, used_settings: dict,
+                    shared_settings: set) -> list:
+    '''
+    Get the stages that have to run again after a change, in the order of stages.
+
+    A stage is affected if it uses a changed setting or read a changed file.
+    Changes that no stage can be traced to, like a changed file that is not read
+    through geodata, and changes to the shared reading settings affect all stages.
+    '''
+    if changed_settings & shared_settings or constrained_airspace() in changed_files:
+        return list(stages)
+
+    affected = {stage for stage in stages if used_settings[stage] & changed_settings}
+
+    for path in changed_files:
+        readers = {stage for stage in stages if reads_file(stage, path)}
+        affected |= readers or set(stages)
+
+    # the stages that read the output of an affected stage
+    for stage in stages:
+        if stage in affected:
+            affected.update(downstream.get(stage, []))
+
+    return [stage for stage in stages if stage in affected]
+
+
+def reads_file(stage: str, path: str) -> bool:
+    '''Check if the object of a stage read the file in the last run.'''
+    obj = getattr(fm, stage_objects[stage], None)
+    path = os.path.normpath(path)
+
+    for source in getattr(obj, '_sources', ()):
+        source = os.path.normpath(source)
+
+        if path == source or path.startswith(source + os.sep):
+            return True
+
+    return False
+
+
+def module_settings(modules: list) -> set:
+    '''Names of the settings that the source code of the modules reads.'''
+    names = set()
+
+    for module in modules:
+        with open(importlib.util.find_spec(module).origin) as f:
+            names.update(re.findall(r'settings\.(\w+)', f.read()))
+
+    return names
+
+
+def settings_snapshot() -> dict:
+    '''Current value of every setting.'''
+    return {key: repr(value) for key, value in vars(fm.settings).items()
+            if not key.startswith('_') and not inspect.ismodule(value) and not inspect.isfunction(value)}
+
+
+def constrained_airspace() -> str:
+    '''Path of the constrained airspace, its bounding box prunes the study layers.'''
+    return os.path.join(fm.settings.geo_data, 'airspace', 'constrained_airspace.gpkg')
+
+
+def input_folders(stages: list) -> set:
+    '''Folders with the input data of the stages.'''
+    folders = {fm.settings.geo_data, os.path.dirname(fm.settings.graph_path),
+               os.path.dirname(fm.settings.sending_nodes), os.path.dirname(fm.settings.receiving_nodes)}
+
+    # the intention files are input if they are not created by the watched stages
+    if 'scenario' in stages and 'intention' not in stages:
+        folders.add(fm.settings.intentions)
+
+    return {folder for folder in folders if folder}
+
+
+def input_mtimes(stages: list) -> dict:
+    '''Modification time of every file in the input folders. Hidden files like caches are skipped.'''
+    mtimes = {}
+
+    for folder in input_folders(stages):
+        for root, dirs, file_names in os.walk(folder):
+            dirs[:] = [name for name in dirs if not name.startswith('.')]
+
+            for file_name in file_names:
+                if file_name.startswith('.'):
+                    continue
+
+                path = os.path.join(root, file_name)
+                try:
+                    mtimes[path] = os.stat(path).st_mtime_ns
+                except FileNotFoundError:
+                    continue
+
+    return mtimes
@@ -0,0 +1,231 @@
+'''FlowManage shared-filesystem work queue module'''
+import os
+import uuid
+import socket
+import threading
+
+import flowmanage as fm
+
+
+class WorkQueue:
+    '''
+    Work queue of files on a shared filesystem, without a server.
+
+    Any number of processes on any host claim a job by creating
+    '<job>.lock' in the queue folder with O_CREAT | O_EXCL, which only one of
+    them can do. The owner renews the lease by touching the lock file every
+    heartbeat seconds. A lock file that was not touched for lease seconds
+    belongs to a dead worker and is broken by renaming it, which again only one
+    process can do. Finished jobs get a '<job>.done' marker.
+
+    The mtimes are compared with the clock of the file server, so the clocks of
+    the hosts do not have to agree. A job can run twice if a live worker misses
+    its lease, so the jobs must write their output atomically.
+
+    A job can have a version, like the mtime of its input file. A done marker
+    of another version does not count, so changed inputs are processed again.
+    '''
+
+    def __init__(self, folder: str, lease: float = 60, heartbeat: float = 10) -> None:
+        '''
+        Parameters
+        ----------
+        folder : str
+            Queue folder on the shared filesystem, created if it does not exist.
+        lease : float, optional
+            Seconds after the last heartbeat at which a claim expires, by default 60.
+        heartbeat : float, optional
+            Seconds between the renewals of the claims of this process, by default 10.
+        '''
+        if heartbeat >= lease:
+            raise ValueError(f'the heartbeat ({heartbeat} s) must be shorter than the lease ({lease} s)')
+
+        self.folder = folder
+        self.lease = lease
+        self.heartbeat = heartbeat
+
+        # identifies the claims of this worker in the lock files
+        self.token = f'{socket.gethostname()}.{os.getpid()}.{uuid.uuid4().hex[:8]}'
+
+        self._claims = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        os.makedirs(folder, exist_ok=True)
+
+    def lock_path(self, job: str) -> str:
+        return os.path.join(self.folder, f'{job}.lock')
+
+    def done_path(self, job: str) -> str:
+        return os.path.join(self.folder, f'{job}.done')
+
+    def is_done(self, job: str, version: str = '') -> bool:
+        try:
+            with open(self.done_path(job)) as f:
+                return f.read() == version
+        except FileNotFoundError:
+            return False
+
+    def claim(self, job: str, version: str = '') -> bool:
+        '''
+        Try to claim a job.
+
+        Parameters
+        ----------
+        job : str
+            Name of the job, it must be a valid file name.
+        version : str, optional
+            Version of the job, by default ''.
+
+        Returns
+        -------
+        bool
+            True if this worker owns the job now, False if it is done or
+            claimed by a live worker.
+        '''
+        if self.is_done(job, version):
+            return False
+
+        if not self._create_lock(job):
+            if not self._break_expired(job) or not self._create_lock(job):
+                return False
+
+        # the job can have finished between the check and the claim
+        if self.is_done(job, version):
+            self.release(job)
+            return False
+
+        with self._lock:
+            self._claims.add(job)
+
+        return True
+
+    def release(self, job: str) -> None:
+        '''Give up a claim, the job can be claimed again.'''
+        with self._lock:
+            self._claims.discard(job)
+
+        # do not remove a lock that another worker took over
+        if self.owner(job) == self.token:
+            try:
+                os.unlink(self.lock_path(job))
+            except FileNotFoundError:
+                pass
+
+    def mark_done(self, job: str, version: str = '') -> None:
+        '''Mark a claimed job as finished and release it.'''
+        # write the marker under another name first so it is never read half written
+        marker_path = os.path.join(self.folder, f'.{job}.{self.token}.done')
+        with open(marker_path, 'w') as f:
+            f.write(version)
+        os.replace(marker_path, self.done_path(job))
+
+        self.release(job)
+
+    def reset(self, job: str) -> None:
+        '''Remove the done marker of a job so it is processed again.'''
+        try:
+            os.unlink(self.done_path(job))
+        except FileNotFoundError:
+            pass
+
+    def owner(self, job: str) -> str | None:
+        '''Token of the worker that holds the lock of a job, None if it is not claimed.'''
+        try:
+            with open(self.lock_path(job)) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def pending(self, jobs: dict) -> list:
+        '''The jobs of {job: version} that are not done.'''
+        return [job for job, version in jobs.items() if not self.is_done(job, version)]
+
+    def start(self) -> None:
+        '''Start renewing the claims of this worker in a background thread.'''
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._renew, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        '''Stop renewing and release all claims of this worker.'''
+        self._stop.set()
+
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        with self._lock:
+            claims = list(self._claims)
+
+        for job in claims:
+            self.release(job)
+
+    def fs_time(self) -> float:
+        '''Current time of the clock of the file server.'''
+        clock_path = os.path.join(self.folder, f'.clock.{self.token}')
+
+        with open(clock_path, 'w'):
+            pass
+
+        try:
+            return os.stat(clock_path).st_mtime
+        finally:
+            os.unlink(clock_path)
+
+    def _create_lock(self, job: str) -> bool:
+        # O_EXCL creation is atomic, also on NFS v3 and later
+        try:
+            fd = os.open(self.lock_path(job), os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return False
+
+        with os.fdopen(fd, 'w') as f:
+            f.write(self.token)
+
+        return True
+
+    def _break_expired(self, job: str) -> bool:
+        # break the lock of a job if its lease expired
+        lock_path = self.lock_path(job)
+
+        try:
+            expired = self.fs_time() - os.stat(lock_path).st_mtime > self.lease
+        except FileNotFoundError:
+            # released in the meantime
+            return True
+
+        if not expired:
+            return False
+
+        # only one worker can rename the lock, the others get FileNotFoundError
+        expired_path = os.path.join(self.folder, f'.{job}.{self.token}.expired')
+        try:
+            os.rename(lock_path, expired_path)
+        except FileNotFoundError:
+            return False
+
+        fm.con.print(f'[magenta]Lease of [bold green]{job}[/] expired, taking it over...')
+        os.unlink(expired_path)
+
+        return True
+
+    def _renew(self) -> None:
+        # touch the locks of this worker until stop() is called
+        while not self._stop.wait(self.heartbeat):
+            with self._lock:
+                claims = list(self._claims)
+
+            for job in claims:
+                if self.owner(job) != self.token:
+                    # another worker took the job over, it will write the same output
+                    fm.con.print(f'[red]Lost the claim of {job}.')
+                    with self._lock:
+                        self._claims.discard(job)
+                    continue
+
+                try:
+                    os.utime(self.lock_path(job))
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,52 @@
+import os
+
+from flowmanage.intentionmaker.intentionindex import build_index, read_window
+from flowmanage.scenariomaker.scenariomaker import write_scenario
+
+INTENTION_COLS = ['acid', 'actype', 'spawn_time', 'origin_lon', 'origin_lat',
+                  'destination_lon', 'destination_lat', 'priority']
+
+SCEN_COLS = ['crecmd', 'acid', 'actype', 'origin_lat', 'origin_lon', 'destination_lat',
+             'destination_lon', 'qdr', 'alt', 'spd', 'priority']
+
+DEFAULT_VALUES = {'crecmd': 'CREM2', 'actype': 'M600', 'qdr': 0, 'alt': 30, 'spd': 10, 'priority': 1}
+
+ROWS = [
+    'D1,MP30,00:00:00,16.328,48.235,16.432,48.191,3\n',
+    'D2,MP20,00:00:30,16.313,48.144,16.350,48.223,1\n',
+    'D3,MP20,00:01:10,16.393,48.268,16.352,48.208,1\n',
+]
+
+
+def write_intentions(tmp_path):
+    file_path = os.path.join(tmp_path, 'Flight_intention_test.csv')
+    with open(file_path, 'w') as f:
+        f.writelines(ROWS)
+
+    build_index(file_path, bucket_size=60, names=INTENTION_COLS)
+
+    return file_path
+
+
+def test_window_inside_file(tmp_path):
+    intentions = read_window(write_intentions(tmp_path), 20, 80, names=INTENTION_COLS)
+
+    assert list(intentions['acid']) == ['D2', 'D3']
+
+
+def test_window_past_end_of_file(tmp_path):
+    file_path = write_intentions(tmp_path)
+
+    intentions = read_window(file_path, 100000, 200000, names=INTENTION_COLS)
+    full = read_window(file_path, 0, 200000, names=INTENTION_COLS)
+
+    assert intentions.empty
+    assert list(intentions.columns) == INTENTION_COLS
+    assert intentions.dtypes.equals(full.dtypes)
+
+    # an empty window still gives a scenario with only the header
+    scenario_path = write_scenario(intentions, os.path.join(tmp_path, 'Flight_intention_test.scn'), SCEN_COLS,
+                                   DEFAULT_VALUES, ['00:00:00>HOLD\n'])
+
+    with open(scenario_path) as f:
+        assert f.read() == '00:00:00>HOLD\n'